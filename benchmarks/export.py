@@ -0,0 +1,109 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Benchmark message serialization for channel exports on synthetic
+histories, comparing per-message writes with the page serializers.
+
+Run with `python -m benchmarks.export`.
+"""
+
+import argparse
+import json
+import time
+from io import BytesIO
+from statistics import median
+
+from benchmarks.fakes import make_messages
+from breadbot.util.export import (
+    message_to_dict,
+    write_messages,
+    write_messages_json,
+)
+
+MESSAGE_COUNTS = [1_000, 10_000, 100_000]
+# Messages per page, as the export cache serializes them
+PAGE_SIZE = 100
+
+
+def per_message_text(messages, buffer: BytesIO):
+    """The text serializer before pages, writing every piece separately."""
+    for message in messages:
+        buffer.write(
+            f"[{message.created_at.isoformat(sep=' ', timespec='seconds')}] "
+            f"{message.author}: "
+            f"{message.clean_content}\n".encode()
+        )
+        if message.attachments:
+            buffer.write(f"[attachments]:\n".encode())
+            for a in message.attachments:
+                buffer.write(f"{a.url}\n".encode())
+
+
+def per_message_json(messages, buffer: BytesIO):
+    """The NDJSON serializer before pages, one json.dumps() per message."""
+    for message in messages:
+        buffer.write(
+            json.dumps(message_to_dict(message), ensure_ascii=False).encode()
+        )
+        buffer.write(b"\n")
+
+
+SERIALIZERS = {
+    "text": (per_message_text, write_messages),
+    "ndjson": (per_message_json, write_messages_json),
+}
+
+
+def rate(serialize, messages, repeat: int) -> tuple[float, bytes]:
+    """
+    Median messages per second serializing `messages` a page at a time
+    into a reused buffer, and the bytes produced.
+    """
+    pages = [
+        messages[i : i + PAGE_SIZE] for i in range(0, len(messages), PAGE_SIZE)
+    ]
+    output = b""
+    times = []
+    for _ in range(repeat):
+        buffer = BytesIO()
+        chunks = []
+        start = time.perf_counter()
+        for page in pages:
+            serialize(page, buffer)
+            chunks.append(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+        times.append(time.perf_counter() - start)
+        output = b"".join(chunks)
+    return len(messages) / median(times), output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--messages", type=int, nargs="*", default=MESSAGE_COUNTS
+    )
+    args = parser.parse_args()
+
+    header = (
+        f"{'messages':>8} {'format':>7} {'per message':>14} "
+        f"{'per page':>14} {'speedup':>8}"
+    )
+    print(header)
+    print("-" * len(header))
+    for count in args.messages:
+        messages = make_messages(count)
+        for name, (before, after) in SERIALIZERS.items():
+            before_rate, before_output = rate(before, messages, args.repeat)
+            after_rate, after_output = rate(after, messages, args.repeat)
+            assert before_output == after_output, f"{name} output differs"
+            print(
+                f"{count:>8} {name:>7} {before_rate:>10,.0f} m/s "
+                f"{after_rate:>10,.0f} m/s {after_rate / before_rate:>7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Lightweight stand-ins for the discord.py objects the sorting and export
+code touches, plus generators for synthetic guilds and message histories.
+
+Edits are recorded instead of sent. Bulk position updates are applied to
+the fake cache right away, the way the gateway events would apply them.
+"""
+
+import itertools
+import random
+import string
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+
+class Recorder:
+    """Collects every API call the fakes receive."""
+
+    def __init__(self):
+        self.calls: list[tuple[str, dict]] = []
+
+    def record(self, call: str, /, **kwargs):
+        self.calls.append((call, kwargs))
+
+    def count(self, call: str | None = None) -> int:
+        return sum(1 for name, _ in self.calls if call in (None, name))
+
+
+class FakeLogChannel:
+    """Swallows log messages, counting them."""
+
+    def __init__(self, recorder: Recorder):
+        self.recorder = recorder
+        self.mention = "#log"
+
+    async def send(self, content=None, **kwargs):
+        self.recorder.record("send", content=content)
+
+
+class FakeHTTP:
+    def __init__(self, guild: "FakeGuild"):
+        self.guild = guild
+
+    async def bulk_channel_update(self, guild_id, data, *, reason=None):
+        self.guild.recorder.record("bulk_channel_update", data=data)
+        for entry in data:
+            channel = self.guild.get_channel(entry["id"])
+            channel.position = entry["position"]
+            if "parent_id" in entry:
+                channel.category_id = entry["parent_id"]
+
+
+class FakeChannel:
+    _sorting_bucket = 0
+
+    def __init__(self, guild, id, name, position, category_id=None):
+        self.guild = guild
+        self.id = id
+        self.name = name
+        self.position = position
+        self.category_id = category_id
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.name}>"
+
+    @property
+    def category(self):
+        return self.guild.get_channel(self.category_id)
+
+    async def edit(self, **kwargs):
+        self.guild.recorder.record("edit", channel=self.id, **kwargs)
+
+
+class FakeTextChannel(FakeChannel):
+    pass
+
+
+class FakeCategory(FakeChannel):
+    _sorting_bucket = 4
+
+    @property
+    def channels(self):
+        return sorted(
+            (c for c in self.guild.channels if c.category_id == self.id),
+            key=lambda c: c.position,
+        )
+
+    async def edit(self, **kwargs):
+        await super().edit(**kwargs)
+        if "name" in kwargs:
+            self.name = kwargs["name"]
+
+
+_guild_ids = itertools.count(1)
+
+
+class FakeGuild:
+    def __init__(self):
+        self.id = next(_guild_ids)
+        self.recorder = Recorder()
+        self._state = SimpleNamespace(http=FakeHTTP(self))
+        self._channels: dict[int, FakeChannel] = {}
+        self.roles = []
+        self.members = []
+
+    @property
+    def channels(self):
+        return list(self._channels.values())
+
+    @property
+    def categories(self):
+        return [
+            c for c in self._channels.values() if isinstance(c, FakeCategory)
+        ]
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    def add(self, channel: FakeChannel) -> FakeChannel:
+        self._channels[channel.id] = channel
+        return channel
+
+    def by_category(self):
+        grouped = {c.id: [] for c in self.categories}
+        grouped.setdefault(None, [])
+        for channel in self._channels.values():
+            if not isinstance(channel, FakeCategory):
+                grouped.setdefault(channel.category_id, []).append(channel)
+        return sorted(
+            (
+                (self.get_channel(k), sorted(v, key=lambda c: c.position))
+                for k, v in grouped.items()
+            ),
+            key=lambda t: (t[0].position, t[0].id) if t[0] else (-1, -1),
+        )
+
+
+def letter_weights(skew: float) -> list[float]:
+    """Zipf-like weights over the alphabet; 0 is uniform."""
+    return [1 / (rank + 1) ** skew for rank in range(26)]
+
+
+def random_name(rng: random.Random, weights: list[float]) -> str:
+    first = rng.choices(string.ascii_lowercase, weights)[0]
+    rest = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 8)))
+    if rng.random() < 0.2:
+        rest += str(rng.randint(1, 30))
+    return first + rest
+
+
+def make_guild(
+    channels: int,
+    categories: int,
+    skew: float = 0.0,
+    archived: int = 0,
+    shuffled: bool = True,
+    seed: int = 0,
+):
+    """
+    Build a fake guild with `channels` project channels spread over
+    `categories` project categories (and `archived` channels in an archive
+    category), plus a matching fake Guild model.
+
+    With `shuffled`, channels are scattered randomly; otherwise they are in
+    sorted order, split evenly between the categories.
+    """
+    rng = random.Random(seed)
+    weights = letter_weights(skew)
+    guild = FakeGuild()
+    next_id = 1000
+    category_objs = []
+    for i in range(categories + 1):
+        category_objs.append(
+            guild.add(FakeCategory(guild, next_id, f"Projects {i:02}", i))
+        )
+        next_id += 1
+    *project_categories, archive_category = category_objs
+    archive_category.name = "Archive"
+
+    names = [random_name(rng, weights) for _ in range(channels)]
+    if shuffled:
+        homes = [rng.choice(project_categories) for _ in names]
+    else:
+        names.sort()
+        homes = [
+            project_categories[i * categories // max(channels, 1)]
+            for i in range(channels)
+        ]
+    names += [random_name(rng, weights) for _ in range(archived)]
+    homes += [archive_category] * archived
+    placed = list(zip(names, homes))
+    if shuffled:
+        rng.shuffle(placed)
+    for position, (name, category) in enumerate(
+        sorted(placed, key=lambda t: t[1].position)
+    ):
+        guild.add(FakeTextChannel(guild, next_id, name, position, category.id))
+        next_id += 1
+
+    model = SimpleNamespace(
+        id=guild.id,
+        project_categories=[
+            SimpleNamespace(id=c.id) for c in project_categories
+        ],
+        archive_category_id=archive_category.id,
+        rebalance_tolerance=0.0,
+    )
+    return guild, model
+
+
+class FakeAuthor:
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMessage:
+    """A message with the attributes the exporters read."""
+
+    def __init__(
+        self,
+        id,
+        channel,
+        author,
+        created_at,
+        content,
+        attachments=(),
+        reactions=(),
+        reference=None,
+        edited_at=None,
+    ):
+        self.id = id
+        self.channel = channel
+        self.author = author
+        self.created_at = created_at
+        self.edited_at = edited_at
+        self.content = self.clean_content = content
+        self.attachments = list(attachments)
+        self.reactions = list(reactions)
+        self.reference = reference
+        self.pinned = False
+
+
+def make_messages(count: int, seed: int = 0) -> list[FakeMessage]:
+    """
+    Build a channel history with a mix of short and long messages, some
+    replies, edits, reactions and attachments.
+    """
+    rng = random.Random(seed)
+    channel = SimpleNamespace(id=1)
+    authors = [FakeAuthor(100 + i, f"user{i}") for i in range(50)]
+    words = ["".join(rng.choices(string.ascii_lowercase, k=6)) + " "] * 3
+    words += ["héllo ", "wörld ", "🍞 ", "channel ", "sort "]
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    messages = []
+    for i in range(count):
+        created_at = start + timedelta(minutes=7 * i)
+        messages.append(
+            FakeMessage(
+                id=10_000 + i,
+                channel=channel,
+                author=rng.choice(authors),
+                created_at=created_at,
+                content="".join(rng.choices(words, k=rng.randint(1, 60))),
+                attachments=(
+                    [
+                        SimpleNamespace(
+                            id=i,
+                            filename=f"image{i}.png",
+                            url=f"https://cdn.example.com/{i}/image{i}.png",
+                            size=rng.randint(1, 10**7),
+                            content_type="image/png",
+                        )
+                    ]
+                    if rng.random() < 0.05
+                    else []
+                ),
+                reactions=(
+                    [SimpleNamespace(emoji="👍", count=3)]
+                    if rng.random() < 0.1
+                    else []
+                ),
+                reference=(
+                    SimpleNamespace(message_id=10_000 + i - 1)
+                    if i and rng.random() < 0.2
+                    else None
+                ),
+                edited_at=(
+                    created_at + timedelta(minutes=1)
+                    if rng.random() < 0.05
+                    else None
+                ),
+            )
+        )
+    return messages
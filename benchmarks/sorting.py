@@ -0,0 +1,193 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Benchmark channel balancing and sorting on synthetic guilds.
+
+Run with `python -m benchmarks.sorting`.
+"""
+
+import argparse
+import asyncio
+import io
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from itertools import chain
+from statistics import median
+
+from benchmarks.fakes import FakeLogChannel, FakeTextChannel, make_guild
+from breadbot.util.channel_sorting import (
+    balanced_categories,
+    plan_sort,
+    reposition_channel,
+    sort_inner,
+    unbalancedness,
+)
+from breadbot.util.discord_objects import get_project_categories
+from breadbot.util.sort_keys import channel_keys
+
+CHANNEL_COUNTS = [10, 100, 1000, 5000]
+CATEGORY_COUNTS = [2, 5, 20]
+SKEWS = {"uniform": 0.0, "skewed": 1.2}
+
+
+def timed(fn, repeat: int) -> float:
+    """Median wall time of `fn()` in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return median(times)
+
+
+def peak_memory(fn) -> int:
+    """Peak traced memory of `fn()` in KiB."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+
+def count_edits(channels, categories, skew, capacity, bulk) -> tuple[int, int]:
+    """Run a full sort and return (API requests, channels moved)."""
+    guild, model = make_guild(channels, categories, skew, archived=5)
+    log = FakeLogChannel(guild.recorder)
+    plan = asyncio.run(
+        sort_inner(
+            guild, model, log, verbose=False, bulk=bulk, capacity=capacity
+        )
+    )
+    requests = guild.recorder.count("edit") + guild.recorder.count(
+        "bulk_channel_update"
+    )
+    if bulk:
+        moved = sum(
+            len(data["data"])
+            for call, data in guild.recorder.calls
+            if call == "bulk_channel_update"
+        )
+    else:
+        moved = len(plan.moves)
+    return requests, moved
+
+
+def reposition_time(channels, categories, skew, repeat) -> float:
+    """Median time to place one new channel in an already sorted guild."""
+    guild, model = make_guild(channels, categories, skew, shuffled=False)
+    project_categories = get_project_categories(guild, model)
+    new_channel = guild.add(
+        FakeTextChannel(guild, 1, "mnew-channel", len(guild.channels))
+    )
+
+    async def run():
+        # First call builds the index
+        await reposition_channel(new_channel, project_categories)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            await reposition_channel(new_channel, project_categories)
+            times.append((time.perf_counter() - start) * 1000)
+        return median(times)
+
+    # reposition_channel prints every move
+    with redirect_stdout(io.StringIO()):
+        return asyncio.run(run())
+
+
+def bench(channels, categories, skew, capacity, repeat):
+    guild, model = make_guild(channels, categories, skew)
+    project_categories = get_project_categories(guild, model)
+    keys = channel_keys(
+        chain.from_iterable(c.channels for c in project_categories)
+    )
+    sorted_channels = sorted(
+        chain.from_iterable(c.channels for c in project_categories),
+        key=lambda ch: keys[ch.id],
+    )
+    try:
+        layout = balanced_categories(
+            project_categories, sorted_channels, keys=keys, capacity=capacity
+        )
+    except ValueError:
+        return None
+    borders = [0]
+    for category in project_categories[:-1]:
+        borders.append(borders[-1] + len(layout[category.id]))
+    borders.append(len(sorted_channels))
+
+    return {
+        "partition_ms": timed(
+            lambda: balanced_categories(
+                project_categories,
+                sorted_channels,
+                keys=keys,
+                capacity=capacity,
+            ),
+            repeat,
+        ),
+        "score_us": timed(lambda: unbalancedness(borders), repeat) * 1000,
+        "plan_ms": timed(lambda: plan_sort(guild, model, capacity), repeat),
+        "plan_kib": peak_memory(lambda: plan_sort(guild, model, capacity)),
+        "reposition_ms": reposition_time(channels, categories, skew, repeat),
+        "edits": count_edits(channels, categories, skew, capacity, bulk=False),
+        "bulk": count_edits(channels, categories, skew, capacity, bulk=True),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--channels", type=int, nargs="*", default=CHANNEL_COUNTS
+    )
+    parser.add_argument(
+        "--categories", type=int, nargs="*", default=CATEGORY_COUNTS
+    )
+    parser.add_argument(
+        "--capacity",
+        type=int,
+        default=None,
+        help="channels per category limit, e.g. Discord's 50 "
+        "(default: unlimited, to measure scaling)",
+    )
+    args = parser.parse_args()
+
+    header = (
+        f"{'channels':>8} {'cats':>4} {'skew':>7} {'partition':>10} "
+        f"{'score':>8} {'plan':>9} {'plan mem':>9} {'reposition':>10} "
+        f"{'edits (moved)':>14} {'bulk reqs (moved)':>18}"
+    )
+    print(header)
+    print("-" * len(header))
+    for channels in args.channels:
+        for categories in args.categories:
+            for skew_name, skew in SKEWS.items():
+                result = bench(
+                    channels, categories, skew, args.capacity, args.repeat
+                )
+                if result is None:
+                    print(
+                        f"{channels:>8} {categories:>4} {skew_name:>7} "
+                        f"no valid partition for this many categories"
+                    )
+                    continue
+                edits, moved = result["edits"]
+                bulk_requests, bulk_moved = result["bulk"]
+                print(
+                    f"{channels:>8} {categories:>4} {skew_name:>7} "
+                    f"{result['partition_ms']:>8.2f}ms "
+                    f"{result['score_us']:>6.1f}us "
+                    f"{result['plan_ms']:>7.2f}ms "
+                    f"{result['plan_kib']:>6}KiB "
+                    f"{result['reposition_ms']:>8.3f}ms "
+                    f"{f'{edits} ({moved})':>14} "
+                    f"{f'{bulk_requests} ({bulk_moved})':>18}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,9 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 """/r/ProgrammingLanguages discord channel management bot."""
+
+import asyncio
+import os
 import sys
 import traceback
 from pathlib import Path
@@ -11,18 +14,20 @@ from discord.ext import commands, tasks
 from tortoise import Tortoise
 
 from breadbot import BASE_DIR
-from breadbot.models import Guild
+from breadbot.models import Guild, upgrade_schema
+from breadbot.util import metrics
 from breadbot.util.bookmark import (
     maybe_serve_bookmark_request,
     maybe_delete_bookmark,
 )
-from breadbot.util.channel_sorting import reposition_channel
+from breadbot.util.channel_index import track_channel, untrack_channel
 from breadbot.util.discord_objects import (
     get_log_channel,
     get_project_categories,
 )
 from breadbot.util.random import get_random_top100_steam_game
-from breadbot.util.usernames import maybe_normalize_nickname
+from breadbot.util.sort_scheduler import sort_scheduler
+from breadbot.util.usernames import mark_dirty, maybe_normalize_nickname
 
 channels_path = Path(__file__).parent / "categories.txt"
 notifs_path = Path(__file__).parent / "notify.json"
@@ -32,54 +37,30 @@ channel_sars = Path(__file__).parent / "channel_roles.json"
 class ChannelBot(commands.Bot):
     """Discordpy bot subclass with convenience methods we need."""
 
+    # How many maintenance jobs may run at the same time
+    maintenance_concurrency = int(
+        os.getenv("CHANNELSORTER_MAINTENANCE_CONCURRENCY", 4)
+    )
+
     @tasks.loop(hours=1)
     async def hourly_update(self):
-        """Clean up channel list and cycle presence."""
-        from breadbot.util.channel_sorting import sort_inner
-        from breadbot.util.periodic_tasks import (
-            archive_inactive_inner,
-            cleanup_db,
-            delete_dead_channels,
+        """Cycle presence."""
+        await self.change_presence(
+            activity=discord.Game(name=get_random_top100_steam_game())
         )
-        from breadbot.util.usernames import maybe_normalize_nickname
 
-        await self.change_presence(
-            activity=discord.Activity(
-                type=discord.ActivityType.watching,
-                name="over the project channels",
-            )
+    @tasks.loop(minutes=1)
+    async def run_maintenance(self):
+        """Start the scheduled maintenance jobs that are due."""
+        from breadbot.util.maintenance import run_due_jobs
+
+        await run_due_jobs(self.guilds, self.maintenance_semaphore)
+
+    @run_maintenance.before_loop
+    async def before_maintenance(self):
+        self.maintenance_semaphore = asyncio.Semaphore(
+            self.maintenance_concurrency
         )
-        try:
-            for guild in self.guilds:
-                guild_obj = await Guild.get_or_none(
-                    id=guild.id
-                ).prefetch_related("project_channels", "project_categories")
-                if not guild_obj:
-                    continue
-                log_channel = get_log_channel(guild, guild_obj)
-                if log_channel is None:
-                    continue
-                print(f"Running hourly update in {guild.name}")
-                print(f"Archiving inactive channels")
-                await archive_inactive_inner(
-                    guild, guild_obj, log_channel, verbose=False
-                )
-                print(f"Deleting dead channels")
-                await delete_dead_channels(
-                    guild, guild_obj, log_channel, verbose=False
-                )
-                print(f"Sorting channels")
-                await sort_inner(guild, guild_obj, log_channel, verbose=True)
-                print(f"Cleaning db")
-                await cleanup_db(guild, guild_obj, log_channel)
-                print(f"Normalizing usernames")
-                for member in guild.members:
-                    await maybe_normalize_nickname(member)
-        finally:
-            await self.change_presence(
-                activity=discord.Game(name=get_random_top100_steam_game())
-            )
-            print(f"Done!")
 
     async def on_ready(self):
         """Set initial presence."""
@@ -88,8 +69,14 @@ class ChannelBot(commands.Bot):
             modules={"models": ["breadbot.models"]},
         )
         await Tortoise.generate_schemas()
+        await upgrade_schema()
         print(f"Successfully logged in as {self.user}")
-        self.hourly_update.start()
+        metrics.install(self.http)
+        # on_ready fires again after reconnecting
+        if not self.hourly_update.is_running():
+            self.hourly_update.start()
+        if not self.run_maintenance.is_running():
+            self.run_maintenance.start()
 
 
 bot = ChannelBot(
@@ -112,6 +99,7 @@ CHANNEL_OWNER_PERMS = discord.PermissionOverwrite(
 @bot.event
 async def on_member_join(member: discord.Member) -> None:
     """Normalize usernames for new members."""
+    mark_dirty(member)
     await maybe_normalize_nickname(member)
 
 
@@ -120,6 +108,9 @@ async def on_member_update(
     before: discord.Member, after: discord.Member
 ) -> None:
     """Normalize usernames on update."""
+    if before.display_name == after.display_name:
+        return
+    mark_dirty(after)
     await maybe_normalize_nickname(after)
 
 
@@ -132,9 +123,22 @@ async def on_command_error(ctx, exception):
     )
 
 
+@bot.event
+async def on_guild_channel_create(channel):
+    """Keep the project channel index up to date."""
+    track_channel(channel)
+
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    """Keep the project channel index up to date."""
+    untrack_channel(channel)
+
+
 @bot.event
 async def on_guild_channel_update(before, after):
     """Move channels to the correct position if they got renamed."""
+    track_channel(after)
     if not isinstance(after, discord.TextChannel):
         return
     guild = await Guild.get_or_none(id=after.guild.id).prefetch_related(
@@ -148,7 +152,8 @@ async def on_guild_channel_update(before, after):
     await get_log_channel(before.guild, guild).send(
         f"Channel {before.mention} was renamed: {before.name} -> {after.name}"
     )
-    await reposition_channel(after, categories)
+    await sort_scheduler.reposition(after, categories)
+    sort_scheduler.request(after.guild)
 
 
 @bot.event
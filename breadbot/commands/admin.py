@@ -13,6 +13,7 @@ import discord
 from discord.ext import commands
 
 from breadbot.bot import bot
+from breadbot.util.metrics import recent_runs
 from breadbot.util.random import get_random_top100_steam_game
 
 
@@ -26,6 +27,22 @@ async def change_presence(ctx):
     await ctx.send("✅ Done!")
 
 
+@bot.command()
+@commands.has_permissions(administrator=True)
+@commands.guild_only()
+async def maintenance_stats(ctx, count: int = 10, phase: str = None):
+    """Show the last maintenance phase runs in this guild."""
+    runs = recent_runs(count, guild_id=ctx.guild.id, phase=phase)
+    if not runs:
+        await ctx.send("No maintenance runs recorded yet.")
+        return
+    lines = [str(run) for run in runs]
+    # Keep the newest runs that fit in a message
+    while len("\n".join(lines)) > 1900:
+        lines.pop(0)
+    await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
+
 @bot.command()
 @commands.is_owner()
 async def run_python(ctx, *, code):
@@ -2,6 +2,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 import asyncio
+import json
 from io import BytesIO
 
 import discord
@@ -10,7 +11,7 @@ from discord.ext.commands import check
 
 from breadbot.bot import bot
 from breadbot.models import Guild, ProjectChannel
-from breadbot.util.channel_sorting import reposition_channel, sort_inner
+from breadbot.util.channel_sorting import sort_inner
 from breadbot.util.checks import (
     guild_supports_project_channels,
     is_admin_or_channel_owner,
@@ -20,8 +21,13 @@ from breadbot.util.discord_objects import (
     get_log_channel,
     get_project_categories,
 )
-from breadbot.util.export import dump_channel_contents
+from breadbot.util.export import (
+    COMPRESSIONS,
+    ExportStream,
+    dump_channel_contents,
+)
 from breadbot.util.periodic_tasks import delete_channel_inner
+from breadbot.util.sort_scheduler import sort_scheduler
 
 
 @bot.command()
@@ -66,7 +72,7 @@ async def make_channel(ctx, owner: discord.Member, name: str):
         owner_role=role.id,
     )
 
-    await reposition_channel(
+    await sort_scheduler.reposition(
         new_channel,
         get_project_categories(ctx.guild, guild),
     )
@@ -76,7 +82,7 @@ async def make_channel(ctx, owner: discord.Member, name: str):
     await owner.add_roles(role, lang_owner_role)
     await ctx.send(f"Created and assigned role {role.mention}.")
 
-    await sort_inner(ctx.guild, guild, ctx.channel, verbose=True)
+    sort_scheduler.request(ctx.guild)
     await ctx.send(f"✅ Done!")
 
 
@@ -161,15 +167,49 @@ async def delete_channel(ctx: discord.ext.commands.Context):
 @bot.command()
 @commands.guild_only()
 @check(is_admin_or_channel_owner)
-async def export(ctx: discord.ext.commands.Context):
-    """Upload a file with the full history of the channel."""
+async def export(ctx: discord.ext.commands.Context, *options: str):
+    """
+    Upload the full history of the channel, split into several files if
+    it's too big. Pass gzip or zstd to compress it, and --ndjson to also
+    get the history as NDJSON, one JSON object per message.
+    """
+    compression = None
+    structured = False
+    for option in options:
+        if option == "--ndjson":
+            structured = True
+        elif option in COMPRESSIONS:
+            compression = option
+        else:
+            raise commands.BadArgument(
+                f"Unknown option {option}. Options: "
+                f"{', '.join(COMPRESSIONS)}, --ndjson"
+            )
     await ctx.send("Exporting channel history. This may take a while...")
-    io = BytesIO()
-    await dump_channel_contents(ctx.channel, io)
-    io.seek(0)
-    await ctx.send(
-        "✅ Done!",
-        file=discord.File(io, filename=f"history.txt"),
+
+    async def upload(file: discord.File, part: int, last: bool):
+        await ctx.send(
+            "✅ Done!" if last and not structured else None, file=file
+        )
+
+    async def upload_structured(file: discord.File, part: int, last: bool):
+        await ctx.send("✅ Done!" if last else None, file=file)
+
+    await dump_channel_contents(
+        ctx.channel,
+        ExportStream(
+            upload, "history.txt", ctx.guild.filesize_limit, compression
+        ),
+        (
+            ExportStream(
+                upload_structured,
+                "history.ndjson",
+                ctx.guild.filesize_limit,
+                compression,
+            )
+            if structured
+            else None
+        ),
     )
 
 
@@ -215,13 +255,36 @@ async def disable_langbot(ctx):
 @commands.guild_only()
 @commands.has_permissions(administrator=True)
 @check(guild_supports_project_channels)
-async def sort(ctx: discord.ext.commands.Context):
-    """Sort project channels."""
+async def sort(ctx: discord.ext.commands.Context, *options: str):
+    """Sort project channels. Pass --plan to only show what would change."""
+    if "--plan" in options:
+        guild = await Guild.get(id=ctx.guild.id).prefetch_related(
+            "project_channels", "project_categories"
+        )
+        plan = await sort_inner(ctx.guild, guild, ctx.channel, dry_run=True)
+        await ctx.send(
+            f"Sorting would rename {len(plan.renames)} categories and move "
+            f"{len(plan.moves)} channels.",
+            files=[
+                discord.File(
+                    BytesIO(plan.to_text().encode()), filename="sort_plan.txt"
+                ),
+                discord.File(
+                    BytesIO(json.dumps(plan.to_dict(), indent=2).encode()),
+                    filename="sort_plan.json",
+                ),
+            ],
+        )
+        return
     await ctx.send("Sorting project channels...")
-    guild = await Guild.get(id=ctx.guild.id).prefetch_related(
-        "project_channels", "project_categories"
-    )
-    await sort_inner(ctx.guild, guild, ctx.channel)
+    # Through the scheduler, so it can't overlap a sort already running
+    plan = await sort_scheduler.run_now(ctx.guild, verbose=True)
+    if plan is None:
+        await ctx.send(
+            "Nothing to sort: set up project categories and a log channel "
+            "first."
+        )
+        return
     await ctx.send("Done!")
 
 
@@ -7,7 +7,7 @@ from discord.ext.commands import check
 
 from breadbot.bot import bot
 from breadbot.models import AutoThreadChannel, Guild
-from breadbot.util.channel_sorting import reposition_channel
+from breadbot.util.activity import record_activity
 from breadbot.util.checks import (
     guild_supports_project_channels,
     is_admin_or_channel_owner,
@@ -18,6 +18,7 @@ from breadbot.util.discord_objects import (
     get_log_channel,
     get_project_categories,
 )
+from breadbot.util.sort_scheduler import sort_scheduler
 
 
 @bot.command()
@@ -153,6 +154,8 @@ async def on_message(message: discord.Message) -> None:
     if not guild:
         return
 
+    await record_activity(guild, message)
+
     autothread_channel = await AutoThreadChannel.get_or_none(
         id=message.channel.id,
         guild=guild,
@@ -179,9 +182,10 @@ async def on_message(message: discord.Message) -> None:
         everyone = discord.utils.get(message.guild.roles, name="@everyone")
         assert everyone is not None
         await message.channel.set_permissions(everyone, overwrite=None)
-        await reposition_channel(
+        await sort_scheduler.reposition(
             message.channel, get_project_categories(message.guild, guild)
         )
+        sort_scheduler.request(message.guild)
         log_channel = get_log_channel(message.guild, guild)
         if log_channel:
             await log_channel.send(
@@ -195,3 +195,20 @@ async def disable_autothreading(ctx, *channels: discord.TextChannel):
             continue
         await cat.delete()
     await ctx.send(f"Done!")
+
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+@commands.guild_only()
+async def set_rebalance_tolerance(ctx, tolerance: float):
+    """
+    Set how much better (0-1) a rebalance must be before a sort moves
+    category boundaries.
+    """
+    if not 0 <= tolerance < 1:
+        await ctx.send("Tolerance must be between 0 and 1.")
+        return
+    guild, _ = await Guild.get_or_create(id=ctx.guild.id)
+    guild.rebalance_tolerance = tolerance
+    await guild.save()
+    await ctx.send(f"Rebalance tolerance set to {tolerance:.0%}.")
@@ -1,9 +1,26 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
-from tortoise import fields
+from tortoise import Tortoise, fields
 from tortoise.models import Model
 
+# Columns added to existing tables after they were first created, which
+# generate_schemas() won't add by itself: (table, column, definition)
+ADDED_COLUMNS = [
+    ("guild", "rebalance_tolerance", "REAL NOT NULL DEFAULT 0"),
+]
+
+
+async def upgrade_schema():
+    """Add any missing ADDED_COLUMNS to the database."""
+    connection = Tortoise.get_connection("default")
+    for table, column, definition in ADDED_COLUMNS:
+        _, rows = await connection.execute_query(f"PRAGMA table_info({table})")
+        if column not in {row["name"] for row in rows}:
+            await connection.execute_script(
+                f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+            )
+
 
 class Guild(Model):
     id = fields.BigIntField(pk=True)
@@ -11,6 +28,9 @@ class Guild(Model):
     archive_category_id = fields.BigIntField(null=True)
     archive_channel_id = fields.BigIntField(null=True)
     channel_owner_role_id = fields.BigIntField(null=True)
+    # Fraction by which a rebalance must improve on the current category
+    # boundaries before the sort moves them
+    rebalance_tolerance = fields.FloatField(default=0.0)
 
     def __str__(self):
         return f"Guild {self.id}"
@@ -45,3 +65,47 @@ class AutoThreadChannel(Model):
 
     def __str__(self):
         return f"AutoThreadChannel {self.id}"
+
+
+class ChannelActivity(Model):
+    id = fields.BigIntField(pk=True)
+    guild = fields.ForeignKeyField(
+        "models.Guild", related_name="channel_activity"
+    )  # type: ignore
+    # Time of the last message not sent by a bot
+    last_message_at = fields.DatetimeField()
+
+    def __str__(self):
+        return f"ChannelActivity {self.id}"
+
+
+class ScheduledJob(Model):
+    id = fields.IntField(pk=True)
+    guild = fields.ForeignKeyField(
+        "models.Guild", related_name="scheduled_jobs"
+    )  # type: ignore
+    phase = fields.CharField(max_length=32)
+    last_run = fields.DatetimeField(null=True)
+    next_run = fields.DatetimeField()
+
+    class Meta:
+        unique_together = (("guild", "phase"),)
+
+    def __str__(self):
+        return f"ScheduledJob {self.phase} in {self.guild_id}"
+
+
+class CheckedName(Model):
+    id = fields.IntField(pk=True)
+    guild = fields.ForeignKeyField(
+        "models.Guild", related_name="checked_names"
+    )  # type: ignore
+    member_id = fields.BigIntField()
+    # CRC32 of the display name the member had when it was last checked
+    fingerprint = fields.BigIntField()
+
+    class Meta:
+        unique_together = (("guild", "member_id"),)
+
+    def __str__(self):
+        return f"CheckedName {self.member_id} in {self.guild_id}"
@@ -0,0 +1,145 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+from collections import Counter
+from datetime import datetime, timedelta
+
+import discord
+
+from breadbot.models import ChannelActivity, Guild
+from breadbot.util.concurrency import RateBudget
+
+# Only write a channel's activity to the database this often, inactivity is
+# measured in days anyway
+RECORD_INTERVAL = timedelta(hours=1)
+
+# Channel ID -> last activity time written to the database
+_recorded: dict[int, datetime] = {}
+
+
+async def record_activity(guild: Guild, message: discord.Message):
+    """Remember when a channel last saw a message from a human."""
+    if message.author.bot:
+        return
+    recorded = _recorded.get(message.channel.id)
+    if recorded is not None and (
+        message.created_at - recorded < RECORD_INTERVAL
+    ):
+        return
+    await set_last_activity(guild, message.channel.id, message.created_at)
+
+
+async def set_last_activity(guild: Guild, channel_id: int, when: datetime):
+    """Store the time of a channel's last human message."""
+    await ChannelActivity.update_or_create(
+        id=channel_id, defaults={"guild": guild, "last_message_at": when}
+    )
+    _recorded[channel_id] = when
+
+
+async def get_last_activity(guild: Guild) -> dict[int, datetime]:
+    """Get the recorded last activity of every channel in a guild."""
+    return dict(
+        await ChannelActivity.filter(guild=guild).values_list(
+            "id", "last_message_at"
+        )
+    )
+
+
+class InactivityDetector:
+    """
+    Decide whether channels have had no human messages since a cutoff,
+    escalating through progressively more expensive checks:
+
+    0. a recorded activity after the cutoff (no API calls),
+    1. the timestamp in the channel's last message ID (no API calls),
+    2. a single newest-first page of history, stopping at the first human,
+    3. a full crawl of the rest of the history after the cutoff.
+
+    Anything found along the way is recorded for next time. `stats` counts
+    how many channels each stage settled and how many requests were made.
+    """
+
+    def __init__(
+        self,
+        guild: Guild,
+        since: datetime,
+        last_activity: dict[int, datetime],
+        probe_limit: int = 100,
+        budget: RateBudget | None = None,
+    ):
+        self.guild = guild
+        self.since = since
+        self.last_activity = last_activity
+        self.probe_limit = probe_limit
+        self.budget = budget
+        self.stats: Counter[str] = Counter()
+
+    async def is_inactive(self, channel: discord.TextChannel) -> bool:
+        """Check whether a channel has been inactive since the cutoff."""
+        recorded = self.last_activity.get(channel.id)
+        if recorded is not None and recorded > self.since:
+            self.stats["recorded"] += 1
+            return False
+        after = max(self.since, recorded) if recorded else self.since
+
+        if channel.last_message_id is None or (
+            discord.utils.snowflake_time(channel.last_message_id) <= after
+        ):
+            self.stats["snowflake"] += 1
+            return True
+
+        await self._request()
+        oldest = None
+        seen = 0
+        async for message in channel.history(
+            limit=self.probe_limit, after=after, oldest_first=False
+        ):
+            if not message.author.bot:
+                self.stats["probe"] += 1
+                await set_last_activity(
+                    self.guild, channel.id, message.created_at
+                )
+                return False
+            oldest = message
+            seen += 1
+        if seen < self.probe_limit:
+            self.stats["probe"] += 1
+            return True
+
+        self.stats["crawl"] += 1
+        crawled = 0
+        found = None
+        await self._request()
+        async for message in channel.history(
+            limit=None, before=oldest, after=after, oldest_first=False
+        ):
+            crawled += 1
+            if crawled % 100 == 0:
+                # The next message comes from a new page
+                await self._request()
+            if not message.author.bot:
+                found = message.created_at
+                break
+        if found is None:
+            return True
+        await set_last_activity(self.guild, channel.id, found)
+        return False
+
+    async def _request(self):
+        """Account for a history request, waiting for the budget if any."""
+        self.stats["requests"] += 1
+        if self.budget is not None:
+            await self.budget.acquire()
+
+    def summary(self) -> str:
+        """Describe how channels were checked."""
+        free = self.stats["recorded"] + self.stats["snowflake"]
+        return (
+            f"Checked {free + self.stats['probe'] + self.stats['crawl']} "
+            f"channels: {self.stats['recorded']} by recorded activity, "
+            f"{self.stats['snowflake']} by last message ID, "
+            f"{self.stats['probe']} by a short probe, {self.stats['crawl']} "
+            f"by a full crawl. Made {self.stats['requests']} history "
+            f"requests; {free} channels needed none."
+        )
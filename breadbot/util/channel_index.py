@@ -0,0 +1,117 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+from bisect import bisect_left, insort
+
+import discord
+
+from breadbot.util.sort_keys import ChannelKey, channel_key, channel_keys
+
+
+class ChannelIndex:
+    """
+    Sorted index of the channels in a guild's project categories, kept up to
+    date from gateway events so placing a single channel doesn't need a full
+    re-sort.
+    """
+
+    def __init__(self, project_categories: list[discord.CategoryChannel]):
+        self.category_ids: set[int] = set()
+        self._keys: list[ChannelKey] = []
+        self._entries: dict[int, ChannelKey] = {}
+        self.rebuild(project_categories)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def rebuild(self, project_categories: list[discord.CategoryChannel]):
+        """Rebuild the index from the guild cache."""
+        self.category_ids = {c.id for c in project_categories}
+        self._entries = channel_keys(
+            ch for c in project_categories for ch in c.channels
+        )
+        self._keys = sorted(self._entries.values())
+
+    def remove(self, channel_id: int):
+        """Drop a channel from the index, if it's there."""
+        key = self._entries.pop(channel_id, None)
+        if key is not None:
+            del self._keys[bisect_left(self._keys, key)]
+
+    def update(self, channel: discord.abc.GuildChannel):
+        """Add, re-key or drop a channel after it was created or edited."""
+        self.remove(channel.id)
+        if channel.category_id not in self.category_ids:
+            return
+        key = channel_key(channel)
+        insort(self._keys, key)
+        self._entries[channel.id] = key
+
+    def neighbours(self, key: ChannelKey) -> tuple[int | None, int | None]:
+        """
+        Return the IDs of the indexed channels right before and right after
+        `key`, ignoring the channel `key` belongs to.
+        """
+        i = bisect_left(self._keys, key)
+        before = i - 1
+        while before >= 0 and self._keys[before].id == key.id:
+            before -= 1
+        after = i
+        while after < len(self._keys) and self._keys[after].id == key.id:
+            after += 1
+        return (
+            self._keys[before].id if before >= 0 else None,
+            self._keys[after].id if after < len(self._keys) else None,
+        )
+
+    def is_stale(
+        self,
+        discord_guild: discord.Guild,
+        project_categories: list[discord.CategoryChannel],
+        channel_ids: tuple[int | None, ...],
+    ) -> bool:
+        """
+        Check the index against the guild cache: the project categories and
+        the given indexed channels must still be what the index thinks.
+        """
+        if self.category_ids != {c.id for c in project_categories}:
+            return True
+        for channel_id in channel_ids:
+            if channel_id is None:
+                continue
+            channel = discord_guild.get_channel(channel_id)
+            if (
+                channel is None
+                or channel.category_id not in self.category_ids
+                or channel.name != self._entries[channel_id].name
+            ):
+                return True
+        return False
+
+
+_indexes: dict[int, ChannelIndex] = {}
+
+
+def get_channel_index(
+    discord_guild: discord.Guild,
+    project_categories: list[discord.CategoryChannel],
+) -> ChannelIndex:
+    """Get the channel index for a guild, building it if necessary."""
+    index = _indexes.get(discord_guild.id)
+    if index is None:
+        index = _indexes[discord_guild.id] = ChannelIndex(project_categories)
+    return index
+
+
+def track_channel(channel: discord.abc.GuildChannel):
+    """Update a guild's channel index after a channel create or update."""
+    index = _indexes.get(channel.guild.id)
+    if index is not None:
+        index.update(channel)
+
+
+def untrack_channel(channel: discord.abc.GuildChannel):
+    """Update a guild's channel index after a channel was deleted."""
+    index = _indexes.get(channel.guild.id)
+    if index is not None:
+        index.remove(channel.id)
@@ -1,16 +1,24 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
-from itertools import chain, combinations
-from typing import Dict, List
+import math
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from itertools import chain
+from typing import Any, Dict, List, NamedTuple
 
 import discord
 
-from breadbot.models import Guild
+from breadbot.models import Guild, ProjectCategory
+from breadbot.util.channel_index import get_channel_index
 from breadbot.util.discord_objects import (
     get_archive_category,
     get_project_categories,
 )
+from breadbot.util.sort_keys import ChannelKey, channel_key, channel_keys
+
+# Discord doesn't allow more channels than this in a single category
+CATEGORY_CHANNEL_LIMIT = 50
 
 
 def unbalancedness(separator_idxs: list[int]) -> int:
@@ -24,9 +32,157 @@ def unbalancedness(separator_idxs: list[int]) -> int:
     return score
 
 
+class CategoryCapacityError(ValueError):
+    """The project channels don't fit in the project categories."""
+
+    def __init__(self, message: str, needed: int | None):
+        super().__init__(message)
+        # Number of categories that would fit everything, None if no number
+        # would because a single letter group is over the limit
+        self.needed = needed
+
+
+def categories_needed(
+    boundaries: list[int], length: int, capacity: int
+) -> int | None:
+    """
+    Return the fewest categories of at most `capacity` channels that fit
+    the letter groups starting at `boundaries`, or None if a single letter
+    group is already too big.
+    """
+    needed, filled = 1, 0
+    for start, end in zip(boundaries, [*boundaries[1:], length]):
+        size = end - start
+        if size > capacity:
+            return None
+        if filled + size > capacity:
+            needed, filled = needed + 1, 0
+        filled += size
+    return needed
+
+
+def optimal_partition(
+    boundaries: list[int],
+    cuts: int,
+    length: int,
+    capacity: int | None = None,
+) -> list[int]:
+    """
+    Pick `cuts` indices out of the sorted `boundaries` so that the
+    unbalancedness of `[0, *partition, length]` is as small as possible,
+    without any part being longer than `capacity`.
+
+    This is a linear-partition dynamic program, O(cuts * len(boundaries)^2).
+    Ties are broken the same way `min()` over `combinations()` would break
+    them: the lexicographically smallest optimal partition wins.
+    """
+    if cuts > len(boundaries):
+        raise ValueError(
+            f"Cannot split {len(boundaries)} letter groups into "
+            f"{cuts + 1} categories."
+        )
+
+    def score(start: int, end: int) -> float:
+        if capacity is not None and end - start > capacity:
+            return math.inf
+        return (end - start) ** 2
+
+    if cuts == 0:
+        partition = []
+    else:
+        partition = _partition(boundaries, cuts, length, score)
+    if capacity is not None and any(
+        end - start > capacity
+        for start, end in zip([0, *partition], [*partition, length])
+    ):
+        needed = categories_needed(boundaries, length, capacity)
+        if needed is None:
+            raise CategoryCapacityError(
+                f"A single starting letter has more than {capacity} "
+                f"channels, so no number of project categories can hold "
+                f"them.",
+                None,
+            )
+        raise CategoryCapacityError(
+            f"{length} channels need at least {needed} project categories "
+            f"of at most {capacity} channels each, but there are only "
+            f"{cuts + 1}.",
+            needed,
+        )
+    return partition
+
+
+def _partition(boundaries, cuts, length, score) -> list[int]:
+    """The dynamic program behind `optimal_partition`."""
+    # cost[r][i]: best score of the segments from boundaries[i] to the end,
+    # given that boundaries[i] is a cut and r more cuts follow it.
+    cost = [[score(b, length) for b in boundaries]]
+    for r in range(1, cuts):
+        prev = cost[-1]
+        cost.append(
+            [
+                min(
+                    score(boundaries[i], boundaries[j]) + prev[j]
+                    for j in range(i + 1, len(boundaries) - r + 1)
+                )
+                for i in range(len(boundaries) - r)
+            ]
+        )
+
+    # Walk forwards, always taking the earliest cut that stays optimal.
+    partition = []
+    start, first = 0, 0
+    for r in reversed(range(cuts)):
+        candidates = range(first, len(boundaries) - r)
+        best = min(
+            score(start, boundaries[i]) + cost[r][i] for i in candidates
+        )
+        for i in candidates:
+            if score(start, boundaries[i]) + cost[r][i] == best:
+                break
+        partition.append(boundaries[i])
+        start, first = boundaries[i], i + 1
+    return partition
+
+
+def current_partition(
+    categories: list[discord.CategoryChannel],
+    channels: list[discord.TextChannel],
+    boundaries: list[int],
+    capacity: int | None = None,
+) -> list[int] | None:
+    """
+    Return the partition of `channels` closest to the categories they are in
+    right now, with every category after the first starting at the letter
+    group of its first channel. Return None if that isn't a valid partition,
+    e.g. because a category is empty or over `capacity`.
+    """
+    first_idxs: dict[int, int] = {}
+    for i, channel in enumerate(channels):
+        first_idxs.setdefault(channel.category_id, i)
+    partition = []
+    for category in categories[1:]:
+        if category.id not in first_idxs:
+            return None
+        first_idx = first_idxs[category.id]
+        cut = boundaries[bisect_right(boundaries, first_idx) - 1]
+        if cut <= (partition[-1] if partition else 0):
+            return None
+        partition.append(cut)
+    if capacity is not None and any(
+        end - start > capacity
+        for start, end in zip([0, *partition], [*partition, len(channels)])
+    ):
+        return None
+    return partition
+
+
 def balanced_categories(
     categories: list[discord.CategoryChannel],
     channels: list[discord.TextChannel],
+    tolerance: float = 0.0,
+    keys: dict[int, ChannelKey] | None = None,
+    capacity: int | None = CATEGORY_CHANNEL_LIMIT,
 ) -> dict[int, list[discord.TextChannel]]:
     """
     Given a list of categories and channels, return a dict mapping category
@@ -34,25 +190,38 @@ def balanced_categories(
     sorted alphabetically, every starting letter is contained entirely
     within a single category, and each category has a similar number of
     channels.
+
+    With a `tolerance`, the current category boundaries are kept unless the
+    best partition's unbalancedness is more than that fraction lower.
+
+    No category gets more than `capacity` channels; CategoryCapacityError
+    is raised if that's impossible.
+
+    `channels` must be sorted by their `keys`, which are computed here if
+    not given.
     """
-    prev_letter = channels[0].name.upper()[0]
+    if keys is None:
+        keys = channel_keys(channels)
+    prev_letter = keys[channels[0].id].letter
     letter_change_idxs = [0]
     # Save indices with letter changes
     for i, channel in enumerate(channels):
-        if channel.name.upper()[0] != prev_letter:
-            prev_letter = channel.name.upper()[0]
+        if keys[channel.id].letter != prev_letter:
+            prev_letter = keys[channel.id].letter
             letter_change_idxs.append(i)
 
-    best_partition = [
-        0,
-        # Find the partition with the smallest unbalancedness
-        *min(
-            combinations(letter_change_idxs, len(categories) - 1),
-            key=lambda partition: unbalancedness(
-                [0, *partition, len(channels)]
-            ),
-        ),
-    ]
+    partition = optimal_partition(
+        letter_change_idxs, len(categories) - 1, len(channels), capacity
+    )
+    if tolerance > 0:
+        current = current_partition(
+            categories, channels, letter_change_idxs, capacity
+        )
+        if current is not None and unbalancedness(
+            [0, *partition, len(channels)]
+        ) >= (1 - tolerance) * unbalancedness([0, *current, len(channels)]):
+            partition = current
+    best_partition = [0, *partition]
     assert len(best_partition) == len(categories)
 
     category_channels = {}
@@ -70,109 +239,383 @@ async def reposition_channel(channel, project_categories):
     Try to position a channel where it should be in the projects
     categories without resorting everything.
     """
-    channels = sorted(
+    discord_guild = channel.guild
+    index = get_channel_index(discord_guild, project_categories)
+    key = channel_key(channel)
+    before_id, after_id = index.neighbours(key)
+    if index.is_stale(
+        discord_guild, project_categories, (before_id, after_id)
+    ):
+        index.rebuild(project_categories)
+        before_id, after_id = index.neighbours(key)
+    before = discord_guild.get_channel(before_id) if before_id else None
+    after = discord_guild.get_channel(after_id) if after_id else None
+
+    if after is not None:
+        category = before.category if before else after.category
+        position = after.position
+    elif before is not None:
+        # Channel should be sorted last
+        category = before.category
+        position = before.position + 1
+    else:
+        category = None
+        position = 1
+    await channel.edit(category=category, position=position)
+    print(f"Moved channel {channel.name}")
+
+
+def layout_payload(
+    discord_guild: discord.Guild,
+    category_channels: dict[int, list[discord.abc.GuildChannel]],
+) -> list[dict[str, Any]]:
+    """
+    Build a bulk channel position update that puts the channels of every
+    category in `category_channels` in the given order.
+
+    Positions are renumbered per sorting bucket in Discord UI order, the same
+    way discord.py does it for a single move, and only channels whose
+    position or category actually changes are included.
+    """
+    managed = {ch.id for chs in category_channels.values() for ch in chs}
+    next_position: dict[int, int] = defaultdict(int)
+    payload = []
+    for category, channels in discord_guild.by_category():
+        if category is not None and category.id in category_channels:
+            channels = category_channels[category.id]
+        else:
+            channels = [ch for ch in channels if ch.id not in managed]
+        parent_id = category.id if category is not None else None
+        for channel in channels:
+            bucket = channel._sorting_bucket
+            position = next_position[bucket]
+            next_position[bucket] += 1
+            if channel.position == position and (
+                channel.category_id == parent_id
+            ):
+                continue
+            entry: dict[str, Any] = {"id": channel.id, "position": position}
+            if channel.category_id != parent_id:
+                entry.update(parent_id=parent_id, lock_permissions=False)
+            payload.append(entry)
+    return payload
+
+
+async def apply_layout(
+    discord_guild: discord.Guild,
+    category_channels: dict[int, list[discord.abc.GuildChannel]],
+) -> int:
+    """
+    Move channels into the layout described by `category_channels` with a
+    single bulk request. Return the number of channels that were moved.
+    """
+    payload = layout_payload(discord_guild, category_channels)
+    if payload:
+        await discord_guild._state.http.bulk_channel_update(
+            discord_guild.id, payload, reason="Sorting project channels"
+        )
+    return len(payload)
+
+
+class ChannelMove(NamedTuple):
+    """A single channel edit: put `channel` into `category` after `after`."""
+
+    channel: discord.abc.GuildChannel
+    category: discord.CategoryChannel
+    # None means the channel goes first in the category
+    after: discord.abc.GuildChannel | None
+    from_category_id: int | None
+
+
+def longest_increasing_subsequence(sequence: list[int]) -> list[int]:
+    """
+    Return the indices of a longest strictly increasing subsequence of
+    `sequence`, in O(n log n).
+    """
+    # tails[k]: index of the smallest tail of an increasing run of length k+1
+    tails: list[int] = []
+    predecessors = [-1] * len(sequence)
+    for i, value in enumerate(sequence):
+        k = bisect_left(tails, value, key=sequence.__getitem__)
+        if k > 0:
+            predecessors[i] = tails[k - 1]
+        if k == len(tails):
+            tails.append(i)
+        else:
+            tails[k] = i
+    result = []
+    i = tails[-1] if tails else -1
+    while i != -1:
+        result.append(i)
+        i = predecessors[i]
+    return result[::-1]
+
+
+def plan_moves(
+    categories: list[discord.CategoryChannel],
+    category_channels: dict[int, list[discord.abc.GuildChannel]],
+) -> tuple[list[ChannelMove], int]:
+    """
+    Plan the smallest set of single-channel moves that turns the current
+    layout into `category_channels`.
+
+    In every category, the longest run of channels that are already in
+    target order stays put and everything else is moved in next to its
+    target predecessor. Also returns how many moves comparing positions
+    index by index would have taken, for reporting.
+    """
+    moves = []
+    naive_moves = 0
+    for category in categories:
+        target = category_channels[category.id]
+        current = category.channels
+        naive_moves += sum(
+            i >= len(current) or current[i] != channel
+            for i, channel in enumerate(target)
+        )
+        target_idxs = {channel.id: i for i, channel in enumerate(target)}
+        staying = [ch for ch in current if ch.id in target_idxs]
+        order = [target_idxs[ch.id] for ch in staying]
+        kept = {staying[i].id for i in longest_increasing_subsequence(order)}
+        for i, channel in enumerate(target):
+            if channel.id not in kept:
+                moves.append(
+                    ChannelMove(
+                        channel,
+                        category,
+                        target[i - 1] if i > 0 else None,
+                        channel.category_id,
+                    )
+                )
+    return moves, naive_moves
+
+
+async def apply_move(discord_guild: discord.Guild, move: ChannelMove):
+    """
+    Apply a planned move with a single channel edit, then update the cached
+    positions the way Discord renumbers them, so later moves in the same run
+    see the new layout before the gateway events arrive.
+    """
+    channel, category, after, _ = move
+    if after is not None:
+        position = after.position + 1
+    else:
+        first = next(
+            (ch for ch in category.channels if ch.id != channel.id), None
+        )
+        position = first.position if first else channel.position
+    await channel.edit(category=category, position=position)
+
+    siblings = sorted(
         (
             ch
-            for c in project_categories
-            for ch in c.channels
-            if ch.id != channel.id
+            for ch in discord_guild.channels
+            if ch._sorting_bucket == channel._sorting_bucket
+            and ch.id != channel.id
         ),
-        key=lambda ch: ch.name,
+        key=lambda ch: ch.position,
     )
-    category = None
-    position = 0
-    for c in channels:
-        position = c.position
-        if c.name > channel.name:
-            if not category:
-                category = c.category
-            break
-        category = c.category
-    else:
-        # Channel should be sorted last
-        position += 1
-    await channel.edit(category=category, position=position)
-    print(f"Moved channel {channel.name}")
+    index = next(
+        (i for i, ch in enumerate(siblings) if ch.position >= position),
+        len(siblings),
+    )
+    siblings.insert(index, channel)
+    for i, ch in enumerate(siblings):
+        ch.position = i
+    channel.category_id = category.id
 
 
-async def sort_inner(
+class CategoryRename(NamedTuple):
+    """A planned category rename."""
+
+    category: discord.CategoryChannel
+    old_name: str
+    new_name: str
+
+
+class SortPlan(NamedTuple):
+    """Everything a sort would change, computed without touching Discord."""
+
+    renames: list[CategoryRename]
+    moves: list[ChannelMove]
+    # Category ID -> channels in target order, for bulk updates
+    layout: dict[int, list[discord.abc.GuildChannel]]
+    # Moves the old index-by-index comparison would have made
+    naive_moves: int
+    # Channels actually moved once the plan was applied
+    moves_made: int = 0
+
+    def to_dict(self) -> dict[str, Any]:
+        """Return a JSON-serializable diff."""
+        return {
+            "renames": [
+                {
+                    "category_id": rename.category.id,
+                    "from": rename.old_name,
+                    "to": rename.new_name,
+                }
+                for rename in self.renames
+            ],
+            "moves": [
+                {
+                    "channel_id": move.channel.id,
+                    "channel": move.channel.name,
+                    "from_category_id": move.from_category_id,
+                    "to_category_id": move.category.id,
+                    "after_id": move.after.id if move.after else None,
+                }
+                for move in self.moves
+            ],
+        }
+
+    def to_text(self) -> str:
+        """Return a human-readable diff."""
+        lines = [
+            f"Rename {rename.old_name} -> {rename.new_name}"
+            for rename in self.renames
+        ]
+        lines.extend(
+            f"Move #{move.channel.name} to {move.category.name}"
+            + (f" after #{move.after.name}" if move.after else " (first)")
+            for move in self.moves
+        )
+        return "\n".join(lines) or "Nothing to do."
+
+
+def plan_sort(
     discord_guild: discord.Guild,
     guild: Guild,
-    log_channel: discord.TextChannel,
-    verbose: bool = True,
-):
-    """Channel sorting logic."""
-    moves_made = 0
-    renames_made = 0
-
+    capacity: int | None = CATEGORY_CHANNEL_LIMIT,
+) -> SortPlan:
+    """Compute the category renames and channel moves a sort would make."""
     categories = get_project_categories(discord_guild, guild)
+    archive_category = get_archive_category(discord_guild, guild)
+    keys = channel_keys(
+        chain.from_iterable(
+            c.channels for c in [*categories, archive_category] if c
+        )
+    )
     channels = sorted(
         chain.from_iterable(c.channels for c in categories),
-        key=lambda ch: ch.name,
+        key=lambda ch: keys[ch.id],
     )
-    category_channels = balanced_categories(categories, channels)
-    archive_category = get_archive_category(discord_guild, guild)
-    # rename project categories
-    for cat_id, cat_channels in category_channels.items():
-        category = discord.utils.get(discord_guild.categories, id=cat_id)
-        assert category is not None
-        start_letter = cat_channels[0].name.upper()[0]
-        end_letter = cat_channels[-1].name.upper()[0]
-        # Rename category if necessary
+    category_channels = balanced_categories(
+        categories, channels, guild.rebalance_tolerance, keys, capacity
+    )
+    renames = []
+    for category in categories:
+        cat_channels = category_channels[category.id]
+        start_letter = keys[cat_channels[0].id].letter
+        end_letter = keys[cat_channels[-1].id].letter
         new_cat_name = f"Projects {start_letter}-{end_letter}"
         if category.name != new_cat_name:
-            renames_made += 1
-            if verbose:
-                await log_channel.send(
-                    f"Renaming {category.name} to {new_cat_name}"
-                )
-            await category.edit(name=new_cat_name)
+            renames.append(
+                CategoryRename(category, category.name, new_cat_name)
+            )
 
     if archive_category is not None:
         category_channels[archive_category.id] = sorted(
-            archive_category.channels, key=lambda ch: ch.name
+            archive_category.channels, key=lambda ch: keys[ch.id]
         )
         categories.append(archive_category)
-    # Shuffle channels around
-    for category in categories:
-        for i, channel in enumerate(category_channels[category.id]):
-            cat_channels = category.channels
-            if len(cat_channels) > i:
-                target_channel = cat_channels[i]
-                new_pos = target_channel.position
-                needs_move = target_channel != channel
-            else:
-                new_pos = cat_channels[-1].position + 1
-                needs_move = cat_channels[-1] != channel
-            if channel.category_id != category.id or needs_move:
-                old_pos = channel.position
-                if old_pos > new_pos:
-                    # moving channel up
-                    for other_channel in channels:
-                        if new_pos <= other_channel.position < old_pos:
-                            other_channel.position += 1
-                else:
-                    # moving channel down
-                    for other_channel in channels:
-                        if old_pos < other_channel.position <= new_pos:
-                            other_channel.position -= 1
-                moves_made += 1
-                channel.category_id = category.id
-                _old_pos_for_logs = channel.position
-                channel.position = new_pos
-                if verbose:
-                    await log_channel.send(
-                        f"Moving channel {channel.name}.\n"
-                        f"Old position: {_old_pos_for_logs}\n"
-                        f"New channel.position: {new_pos}\n"
-                        f"New position: {category.channels[i].position}.\n"
-                    )
-                await channel.edit(
-                    category=category, position=category.channels[i].position
+    moves, naive_moves = plan_moves(categories, category_channels)
+    return SortPlan(renames, moves, category_channels, naive_moves)
+
+
+async def add_project_categories(
+    discord_guild: discord.Guild,
+    guild: Guild,
+    count: int,
+    log_channel: discord.TextChannel,
+):
+    """Create and register `count` more project categories."""
+    categories = get_project_categories(discord_guild, guild)
+    last = max(categories, key=lambda c: c.position)
+    for _ in range(count):
+        # The next sort renames it, "~" just keeps it sorted last until then
+        category = await discord_guild.create_category(
+            "Projects ~",
+            overwrites=last.overwrites,
+            position=last.position + 1,
+            reason="Project categories are full",
+        )
+        # Don't wait for the gateway event to see the category in the cache
+        discord_guild._add_channel(category)
+        await ProjectCategory.create(id=category.id, guild=guild)
+        await log_channel.send(
+            f"Project categories are full, created {category.mention}."
+        )
+    await guild.fetch_related("project_categories")
+
+
+async def sort_inner(
+    discord_guild: discord.Guild,
+    guild: Guild,
+    log_channel: discord.TextChannel,
+    verbose: bool = True,
+    bulk: bool = False,
+    dry_run: bool = False,
+    capacity: int | None = CATEGORY_CHANNEL_LIMIT,
+) -> SortPlan:
+    """
+    Channel sorting logic.
+
+    With `bulk`, all channel moves are pushed in one bulk position update
+    instead of one edit per misplaced channel. With `dry_run`, nothing is
+    changed and the returned plan is all there is. Otherwise the returned
+    plan records how many channels were actually moved.
+
+    If the project channels don't fit in the project categories, new ones
+    are created, unless this is a dry run or no number of categories would
+    do, in which case CategoryCapacityError is raised.
+    """
+    try:
+        plan = plan_sort(discord_guild, guild, capacity)
+    except CategoryCapacityError as e:
+        if dry_run or e.needed is None:
+            raise
+        await add_project_categories(
+            discord_guild,
+            guild,
+            e.needed - len(guild.project_categories),
+            log_channel,
+        )
+        plan = plan_sort(discord_guild, guild, capacity)
+    if dry_run:
+        return plan
+
+    for rename in plan.renames:
+        if verbose:
+            await log_channel.send(
+                f"Renaming {rename.old_name} to {rename.new_name}"
+            )
+        await rename.category.edit(name=rename.new_name)
+
+    if bulk:
+        moves_made = await apply_layout(discord_guild, plan.layout)
+        if verbose and moves_made > 0:
+            await log_channel.send(
+                f"Moved {moves_made} channels in a single bulk update."
+            )
+    else:
+        for move in plan.moves:
+            if verbose:
+                await log_channel.send(
+                    f"Moving channel {move.channel.name} to "
+                    f"{move.category.name}"
+                    + (f", after {move.after.name}." if move.after else ".")
                 )
+            await apply_move(discord_guild, move)
+        moves_made = len(plan.moves)
+        if verbose and plan.naive_moves > moves_made:
+            await log_channel.send(
+                f"Saved {plan.naive_moves - moves_made} channel edits by "
+                f"only moving out-of-order channels."
+            )
 
-    if renames_made > 0 or moves_made > 0:
+    if plan.renames or moves_made > 0:
         await log_channel.send(
-            f"Channels sorted! Renamed {renames_made} categories and "
+            f"Channels sorted! Renamed {len(plan.renames)} categories and "
             f"moved {moves_made} channels."
         )
+    return plan._replace(moves_made=moves_made)
@@ -0,0 +1,64 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import asyncio
+import time
+from typing import Awaitable, Iterable, TypeVar
+
+from breadbot.util.metrics import count_budget_wait
+
+T = TypeVar("T")
+
+
+class RateBudget:
+    """
+    Token bucket shared between concurrent tasks making API requests:
+    at most `rate` requests per second on average, in bursts of up to
+    `burst`.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated: float | None = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a request may be made."""
+        start = time.perf_counter()
+        try:
+            await self._take()
+        finally:
+            count_budget_wait(time.perf_counter() - start)
+
+    async def _take(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self._updated is not None:
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._updated) * self.rate,
+                )
+            self._updated = now
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._tokens = 1
+                self._updated = loop.time()
+            self._tokens -= 1
+
+
+async def gather_bounded(aws: Iterable[Awaitable[T]], limit: int) -> list[T]:
+    """Like asyncio.gather, but with at most `limit` awaitables running."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw: Awaitable[T]) -> T:
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws))
+
+
+# Shared by every guild's history scans
+history_budget = RateBudget(rate=10, burst=20)
@@ -1,41 +1,239 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import asyncio
+import gzip
+import json
 from io import BytesIO
+from tempfile import TemporaryFile
+from typing import IO, Any, Awaitable, Callable, Iterable
 
 import discord
 
+from breadbot.util.export_cache import ExportCache
 
-def write_message(message: discord.Message, buffer: BytesIO):
-    buffer.write(
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Room left in every part for data still buffered in the compressor
+PART_HEADROOM = 256 * 1024
+
+# Compression: file extension
+COMPRESSIONS = {"gzip": ".gz"}
+if zstandard is not None:
+    COMPRESSIONS["zstd"] = ".zst"
+
+# Shared, since json.dumps() builds a new encoder for non-default options
+_json_encoder = json.JSONEncoder(ensure_ascii=False)
+
+# Called with each finished part, its number, and whether it is the last
+Upload = Callable[[discord.File, int, bool], Awaitable[object]]
+
+
+class ExportStream:
+    """
+    Binary sink that spools an export to temporary files, optionally
+    compressed, and uploads it in parts of at most `part_size` bytes as
+    soon as each one is full.
+
+    Parts are spooled to disk rather than to a SpooledTemporaryFile, which
+    discord.File only accepts from Python 3.11.
+    """
+
+    def __init__(
+        self,
+        upload: Upload,
+        filename: str,
+        part_size: int,
+        compression: str | None = None,
+    ):
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Unsupported compression: {compression}")
+        self.upload = upload
+        self.filename = filename
+        self.part_size = part_size
+        self.compression = compression
+        self.part = 0
+        self._spool: IO[bytes] | None = None
+        self._writer: IO[bytes] | None = None
+
+    @property
+    def _limit(self) -> int:
+        if self.compression is None:
+            return self.part_size
+        return self.part_size - PART_HEADROOM
+
+    def _open(self):
+        self.part += 1
+        self._spool = TemporaryFile()
+        if self.compression == "gzip":
+            self._writer = gzip.GzipFile(fileobj=self._spool, mode="wb")
+        elif self.compression == "zstd":
+            self._writer = zstandard.ZstdCompressor().stream_writer(
+                self._spool, closefd=False
+            )
+        else:
+            self._writer = self._spool
+
+    def _part_filename(self, last: bool) -> str:
+        stem, dot, extension = self.filename.rpartition(".")
+        if not dot:
+            stem, extension = extension, ""
+        if not (last and self.part == 1):
+            stem = f"{stem}.part{self.part}"
+        return (
+            stem
+            + dot
+            + extension
+            + COMPRESSIONS.get(self.compression or "", "")
+        )
+
+    async def _finish_part(self, last: bool):
+        if self._writer is not self._spool:
+            self._writer.close()
+        self._spool.seek(0)
+        try:
+            await self.upload(
+                discord.File(self._spool, filename=self._part_filename(last)),
+                self.part,
+                last,
+            )
+        finally:
+            self._spool.close()
+            self._spool = self._writer = None
+
+    async def write(self, data: bytes):
+        """Write data, uploading the current part first if it's full."""
+        if self._spool is None:
+            self._open()
+        elif self._spool.tell() + len(data) > self._limit:
+            await self._finish_part(last=False)
+            self._open()
+        self._writer.write(data)
+
+    async def close(self):
+        """Upload the last part."""
+        if self._spool is None:
+            self._open()
+        await self._finish_part(last=True)
+
+
+def format_message(message: discord.Message) -> str:
+    """Return the text log lines of a message."""
+    line = (
         f"[{message.created_at.isoformat(sep=' ', timespec='seconds')}] "
-        f"{message.author}: "
-        f"{message.clean_content}\n".encode()
+        f"{message.author}: {message.clean_content}\n"
     )
     if message.attachments:
-        buffer.write(f"[attachments]:\n".encode())
-        for a in message.attachments:
-            buffer.write(f"{a.url}\n".encode())
+        return (
+            line
+            + "[attachments]:\n"
+            + "".join(f"{a.url}\n" for a in message.attachments)
+        )
+    return line
+
+
+def write_messages(messages: Iterable[discord.Message], buffer: BytesIO):
+    """Write a page of messages to a text log, encoded in one go."""
+    buffer.write("".join(map(format_message, messages)).encode())
+
+
+def write_message(message: discord.Message, buffer: BytesIO):
+    write_messages((message,), buffer)
+
 
+def message_to_dict(message: discord.Message) -> dict[str, Any]:
+    """Return the structured form of a message."""
+    return {
+        "id": message.id,
+        "channel_id": message.channel.id,
+        "author_id": message.author.id,
+        "author": str(message.author),
+        "created_at": message.created_at.isoformat(),
+        "edited_at": (
+            message.edited_at.isoformat() if message.edited_at else None
+        ),
+        "content": message.content,
+        "reference": (
+            message.reference.message_id if message.reference else None
+        ),
+        "pinned": message.pinned,
+        "reactions": [
+            {"emoji": str(reaction.emoji), "count": reaction.count}
+            for reaction in message.reactions
+        ],
+        "attachments": [
+            {
+                "id": attachment.id,
+                "filename": attachment.filename,
+                "url": attachment.url,
+                "size": attachment.size,
+                "content_type": attachment.content_type,
+            }
+            for attachment in message.attachments
+        ],
+    }
 
-async def dump_channel_contents(channel: discord.TextChannel, buffer: BytesIO):
+
+def write_messages_json(messages: Iterable[discord.Message], buffer: BytesIO):
+    """Write a page of messages as NDJSON, encoded in one go."""
+    encode = _json_encoder.encode
     buffer.write(
+        "".join(
+            encode(message_to_dict(message)) + "\n" for message in messages
+        ).encode()
+    )
+
+
+# Cache file extension: page serializer
+SERIALIZERS = {"txt": write_messages, "ndjson": write_messages_json}
+
+
+async def dump_channel_contents(
+    channel: discord.TextChannel,
+    stream: ExportStream,
+    structured: ExportStream | None = None,
+):
+    """
+    Stream a channel's pins and history to `stream`, and if given, its
+    history as NDJSON (one JSON object per message) to `structured`, then
+    close them. The history comes from the channel's export cache, after
+    fetching any messages that are new since the last export.
+    """
+    cache = ExportCache(channel.guild.id, channel.id, SERIALIZERS)
+    # Fetch the pins while the history is being fetched
+    pins_task = asyncio.create_task(channel.pins())
+    try:
+        async with cache.lock:
+            await cache.update(channel)
+    except BaseException:
+        pins_task.cancel()
+        raise
+    pins = await pins_task
+
+    page = BytesIO()
+    page.write(
         f"Channel: #{channel.name}\n"
         f"Topic: {channel.topic}\n".encode()
     )
     message: discord.Message
-    pins = await channel.pins()
     if pins:
-        buffer.write(b"\nPins:\n\n")
+        page.write(b"\nPins:\n\n")
 
     for message in pins:
-        buffer.write(f"[PINNED]".encode())
-        write_message(message, buffer)
+        page.write(f"[PINNED]".encode())
+        write_message(message, page)
 
-    buffer.write(b"\nChannel history:\n\n")
+    page.write(b"\nChannel history:\n\n")
+    await stream.write(page.getvalue())
 
-    async for message in channel.history(
-        limit=None,
-        oldest_first=True,
-    ):
-        write_message(message, buffer)
+    async with cache.lock:
+        async for chunk in cache.read("txt"):
+            await stream.write(chunk)
+        await stream.close()
+        if structured is not None:
+            async for chunk in cache.read("ndjson"):
+                await structured.write(chunk)
+            await structured.close()
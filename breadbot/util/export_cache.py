@@ -0,0 +1,311 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import asyncio
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from io import BytesIO
+from pathlib import Path
+from typing import AsyncIterator, Callable, Iterable
+
+import discord
+
+from breadbot import BASE_DIR
+from breadbot.util.concurrency import history_budget
+
+# Caches live in one directory per guild
+EXPORTS_DIR = BASE_DIR / "exports"
+# How many messages are appended between checkpoints
+CHECKPOINT_EVERY = 100
+# Size of the chunks cached history is read back in
+READ_SIZE = 64 * 1024
+# Messages per history request
+PAGE_SIZE = 100
+# History is fetched in up to MAX_SHARDS ranges, one per SHARD_SPAN of time
+MAX_SHARDS = 8
+SHARD_SPAN = timedelta(days=60)
+# How many history requests are in flight for one export
+SHARD_CONCURRENCY = 4
+# How many pages are buffered per range while earlier ranges are written
+SHARD_BUFFER = 4
+
+# Renders a page of messages into a cache file's buffer
+Serializer = Callable[[list[discord.Message], BytesIO], None]
+
+_locks: defaultdict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+
+class ExportCache:
+    """
+    Append-only store of a channel's rendered history, in one file per
+    format, with a checkpoint of the last message it contains, so exports
+    only fetch what's new.
+
+    Every batch of appended messages is a page. An index file records where
+    each page ends in every format, so the history can be read back in
+    chunks that end on message boundaries.
+
+    Messages edited or deleted after they were cached keep their cached
+    form.
+    """
+
+    def __init__(
+        self,
+        guild_id: int,
+        channel_id: int,
+        serializers: dict[str, Serializer],
+        directory: Path = EXPORTS_DIR,
+    ):
+        self.channel_id = channel_id
+        self.serializers = serializers
+        self.directory = directory = directory / str(guild_id)
+        self.checkpoint_path = directory / f"{channel_id}.json"
+        self.index_path = directory / f"{channel_id}.index"
+        self.last_id: int | None = None
+        self.offsets = dict.fromkeys(serializers, 0)
+        self.index_offset = 0
+        # Offsets at which each page ends, by format
+        self.pages: list[dict[str, int]] = []
+
+    def path(self, extension: str) -> Path:
+        """Return the path of the cache file for a format."""
+        return self.directory / f"{self.channel_id}.{extension}"
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        """Lock to hold while updating or reading the cache."""
+        return _locks[self.channel_id]
+
+    def load(self):
+        """
+        Read the checkpoint and page index, and drop anything appended after
+        the checkpoint by an interrupted update. A cache missing some of the
+        formats, or with files shorter than the checkpoint says, is rebuilt
+        from scratch.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        try:
+            checkpoint = json.loads(self.checkpoint_path.read_text())
+        except FileNotFoundError:
+            checkpoint = {}
+        offsets = checkpoint.get("offsets", {})
+        if (
+            offsets.keys() >= self.serializers.keys()
+            and "index_offset" in checkpoint
+        ):
+            self.last_id = checkpoint["last_id"]
+            self.offsets = {ext: offsets[ext] for ext in self.serializers}
+            self.index_offset = checkpoint["index_offset"]
+        else:
+            self.last_id = None
+            self.offsets = dict.fromkeys(self.serializers, 0)
+            self.index_offset = 0
+        files = {
+            self.path(ext): offset for ext, offset in self.offsets.items()
+        }
+        files[self.index_path] = self.index_offset
+        sizes = {
+            path: path.stat().st_size if path.exists() else 0 for path in files
+        }
+        if any(sizes[path] < offset for path, offset in files.items()):
+            # Truncating would pad the files with NUL bytes
+            self.last_id = None
+            self.offsets = dict.fromkeys(self.serializers, 0)
+            self.index_offset = 0
+            files = dict.fromkeys(files, 0)
+        for path, offset in files.items():
+            with open(path, "ab") as f:
+                if f.tell() > offset:
+                    f.truncate(offset)
+        with open(self.index_path, "rb") as f:
+            self.pages = [json.loads(line) for line in f]
+
+    def _write(self, data: dict[str, bytes], last_id: int):
+        """Append serialized pages to the files and move the checkpoint."""
+        for extension, page in data.items():
+            with open(self.path(extension), "ab") as f:
+                f.write(page)
+                f.flush()
+                os.fsync(f.fileno())
+                self.offsets[extension] = f.tell()
+        self.pages.append(dict(self.offsets))
+        with open(self.index_path, "ab") as f:
+            f.write(json.dumps(self.offsets).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+            self.index_offset = f.tell()
+        self.last_id = last_id
+        temporary = self.checkpoint_path.with_suffix(".tmp")
+        temporary.write_text(
+            json.dumps(
+                {
+                    "last_id": self.last_id,
+                    "offsets": self.offsets,
+                    "index_offset": self.index_offset,
+                }
+            )
+        )
+        os.replace(temporary, self.checkpoint_path)
+
+    async def _append(
+        self, messages: list[discord.Message], pages: dict[str, BytesIO]
+    ):
+        data = {}
+        for extension, page in pages.items():
+            self.serializers[extension](messages, page)
+            data[extension] = page.getvalue()
+            page.seek(0)
+            page.truncate()
+        # Keep disk writes and fsyncs off the event loop
+        await asyncio.to_thread(self._write, data, messages[-1].id)
+
+    async def update(self, channel: discord.TextChannel) -> int:
+        """
+        Append the messages sent since the checkpoint in every format,
+        returning how many there were.
+        """
+        await asyncio.to_thread(self.load)
+        pages = {extension: BytesIO() for extension in self.serializers}
+        batch = []
+        count = 0
+        async for message in fetch_history(channel, self.last_id):
+            batch.append(message)
+            if len(batch) == CHECKPOINT_EVERY:
+                await self._append(batch, pages)
+                count += len(batch)
+                batch.clear()
+        if batch:
+            await self._append(batch, pages)
+            count += len(batch)
+        return count
+
+    async def read(self, extension: str) -> AsyncIterator[bytes]:
+        """
+        Yield a format's cached history in chunks of whole pages, up to
+        READ_SIZE bytes unless a single page is bigger.
+        """
+        with open(self.path(extension), "rb") as f:
+            start = end = 0
+            for page in self.pages:
+                if page[extension] - start > READ_SIZE and end > start:
+                    yield await asyncio.to_thread(f.read, end - start)
+                    start = end
+                end = page[extension]
+            if end > start:
+                yield await asyncio.to_thread(f.read, end - start)
+
+
+def shard_bounds(start: datetime, end: datetime, after_id: int) -> list[int]:
+    """
+    Split the time from `start` to `end` into ranges of message IDs, more
+    of them the longer it is. Range i holds the IDs in
+    (bounds[i], bounds[i + 1]], and the last one is open-ended.
+    """
+    shards = max(1, min(MAX_SHARDS, (end - start) // SHARD_SPAN))
+    step = (end - start) / shards
+    return [after_id] + [
+        discord.utils.time_snowflake(start + step * i, high=True)
+        for i in range(1, shards)
+    ]
+
+
+async def _fetch_shard(
+    channel: discord.TextChannel,
+    after: int,
+    before: int | None,
+    queue: asyncio.Queue,
+    semaphore: asyncio.Semaphore,
+):
+    """
+    Put the messages in one range of IDs into `queue` a page at a time,
+    oldest first. A page shorter than PAGE_SIZE ends the range; an
+    exception is passed on in place of a page.
+    """
+    messages = channel.history(
+        limit=None,
+        after=discord.Object(after),
+        before=discord.Object(before) if before else None,
+        oldest_first=True,
+    ).__aiter__()
+    try:
+        while True:
+            page = []
+            async with semaphore:
+                await history_budget.acquire()
+                async for message in messages:
+                    page.append(message)
+                    if len(page) == PAGE_SIZE:
+                        break
+            await queue.put(page)
+            if len(page) < PAGE_SIZE:
+                return
+    except Exception as e:
+        await queue.put(e)
+
+
+async def fetch_history(
+    channel: discord.TextChannel, after_id: int | None
+) -> AsyncIterator[discord.Message]:
+    """
+    Yield a channel's messages after `after_id`, oldest first. Long spans
+    of history are split into ranges that are fetched concurrently and
+    merged back in order, with a few pages buffered per range.
+    """
+    start = (
+        discord.utils.snowflake_time(after_id)
+        if after_id
+        else channel.created_at
+    )
+    bounds = shard_bounds(
+        start, discord.utils.utcnow(), after_id or channel.id
+    )
+    semaphore = asyncio.Semaphore(SHARD_CONCURRENCY)
+    queues = [asyncio.Queue(maxsize=SHARD_BUFFER) for _ in bounds]
+    tasks = [
+        asyncio.create_task(
+            _fetch_shard(channel, after, before, queue, semaphore)
+        )
+        for after, before, queue in zip(
+            bounds, [b + 1 for b in bounds[1:]] + [None], queues
+        )
+    ]
+    try:
+        for queue in queues:
+            while True:
+                page = await queue.get()
+                if isinstance(page, Exception):
+                    raise page
+                for message in page:
+                    yield message
+                if len(page) < PAGE_SIZE:
+                    break
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def delete_export_cache(
+    guild_id: int, channel_id: int, directory: Path = EXPORTS_DIR
+):
+    """Remove the cache of a channel that no longer exists."""
+    for path in (directory / str(guild_id)).glob(f"{channel_id}.*"):
+        path.unlink(missing_ok=True)
+
+
+def prune_export_caches(
+    guild_id: int, channel_ids: Iterable[int], directory: Path = EXPORTS_DIR
+) -> int:
+    """
+    Remove the caches of a guild's channels that aren't in `channel_ids`,
+    returning how many channels' caches were removed.
+    """
+    live = {str(channel_id) for channel_id in channel_ids}
+    stale = set()
+    for path in (directory / str(guild_id)).glob("*.*"):
+        channel_id = path.name.partition(".")[0]
+        if channel_id not in live:
+            path.unlink(missing_ok=True)
+            stale.add(channel_id)
+    return len(stale)
@@ -0,0 +1,193 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import asyncio
+import os
+import random
+import sys
+import traceback
+import zlib
+from datetime import timedelta
+
+import discord
+
+from breadbot.models import Guild, ScheduledJob
+from breadbot.util.discord_objects import get_log_channel
+from breadbot.util.metrics import measure
+from breadbot.util.periodic_tasks import (
+    archive_inactive_inner,
+    cleanup_db,
+    delete_dead_channels,
+)
+from breadbot.util.sort_scheduler import sort_scheduler
+from breadbot.util.usernames import normalize_nicknames
+
+# Maximum random delay added on top of a job's slot, in seconds
+JITTER = 60.0
+
+
+async def _archive(discord_guild, guild, log_channel):
+    archived = await archive_inactive_inner(
+        discord_guild, guild, log_channel, verbose=False
+    )
+    sort_scheduler.request(discord_guild)
+    return archived
+
+
+async def _delete(discord_guild, guild, log_channel):
+    deleted = await delete_dead_channels(
+        discord_guild, guild, log_channel, verbose=False
+    )
+    sort_scheduler.request(discord_guild)
+    return deleted
+
+
+async def _cleanup(discord_guild, guild, log_channel):
+    return await cleanup_db(discord_guild, guild, log_channel)
+
+
+async def _nicknames(discord_guild, guild, log_channel):
+    return await normalize_nicknames(discord_guild, guild, log_channel)
+
+
+# How often each maintenance phase runs, in hours, overridable with
+# CHANNELSORTER_INTERVAL_<PHASE>. Sorting isn't a phase: it runs on demand
+# through the sort scheduler whenever channels move.
+PHASE_INTERVALS = {
+    phase: timedelta(
+        hours=float(
+            os.getenv(f"CHANNELSORTER_INTERVAL_{phase.upper()}", default)
+        )
+    )
+    for phase, default in {
+        "archive": 24,
+        "delete": 24,
+        "cleanup": 24,
+        "nicknames": 24 * 7,
+    }.items()
+}
+
+# Maintenance phases, in the order they are spread over their interval
+PHASES = {
+    "archive": _archive,
+    "delete": _delete,
+    "cleanup": _cleanup,
+    "nicknames": _nicknames,
+}
+
+# Scheduled jobs currently running, as (guild ID, phase)
+_running: set[tuple[int, str]] = set()
+# Their tasks, kept alive until they finish
+_tasks: set[asyncio.Task] = set()
+
+
+def phase_offset(guild_id: int, phase: str, window: float) -> float:
+    """
+    Return when in a `window` of seconds a guild's phase should run.
+
+    Every guild gets a fixed offset derived from its ID, and its phases are
+    spread evenly over the window from there, so the load is flat across
+    guilds and phases.
+    """
+    guild_offset = zlib.crc32(str(guild_id).encode()) / 2**32
+    phase_index = list(PHASES).index(phase)
+    return (guild_offset + phase_index / len(PHASES)) % 1 * window
+
+
+async def run_phase(discord_guild: discord.Guild, phase: str):
+    """
+    Run a single maintenance phase for a guild. Failures are reported and
+    don't propagate.
+    """
+    try:
+        guild = await Guild.get_or_none(id=discord_guild.id).prefetch_related(
+            "project_channels", "project_categories"
+        )
+        if not guild:
+            return
+        log_channel = get_log_channel(discord_guild, guild)
+        if log_channel is None:
+            return
+        print(f"[{discord_guild.name}] Running {phase}")
+        async with measure(discord_guild, phase) as run:
+            run.items = await PHASES[phase](discord_guild, guild, log_channel)
+    except Exception:
+        print(
+            f"[{discord_guild.name}] {phase} failed",
+            file=sys.stderr,
+        )
+        traceback.print_exc()
+
+
+async def ensure_jobs(discord_guilds: list[discord.Guild]):
+    """
+    Create the scheduled jobs of registered guilds that don't have them yet.
+    A new job's first run is staggered within one interval from now.
+    """
+    registered = await Guild.filter(
+        id__in=[g.id for g in discord_guilds]
+    ).values_list("id", flat=True)
+    existing = set(await ScheduledJob.all().values_list("guild_id", "phase"))
+    now = discord.utils.utcnow()
+    new_jobs = [
+        ScheduledJob(
+            guild_id=guild_id,
+            phase=phase,
+            next_run=now
+            + timedelta(
+                seconds=phase_offset(guild_id, phase, interval.total_seconds())
+            ),
+        )
+        for guild_id in registered
+        for phase, interval in PHASE_INTERVALS.items()
+        if (guild_id, phase) not in existing
+    ]
+    if new_jobs:
+        await ScheduledJob.bulk_create(new_jobs)
+
+
+async def run_due_jobs(
+    discord_guilds: list[discord.Guild], semaphore: asyncio.Semaphore
+):
+    """Start every scheduled job that is due and not already running."""
+    await ensure_jobs(discord_guilds)
+    by_id = {g.id: g for g in discord_guilds}
+    due = await ScheduledJob.filter(
+        next_run__lte=discord.utils.utcnow(), guild_id__in=list(by_id)
+    )
+    for job in due:
+        key = (job.guild_id, job.phase)
+        if job.phase not in PHASES or key in _running:
+            continue
+        _running.add(key)
+        task = asyncio.create_task(
+            run_job(by_id[job.guild_id], job, semaphore)
+        )
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+
+async def run_job(
+    discord_guild: discord.Guild,
+    job: ScheduledJob,
+    semaphore: asyncio.Semaphore,
+):
+    """
+    Run a scheduled job after some jitter, then move it to the same slot in
+    its next interval.
+    """
+    try:
+        await asyncio.sleep(random.uniform(0, JITTER))
+        async with semaphore:
+            started = discord.utils.utcnow()
+            await run_phase(discord_guild, job.phase)
+        interval = PHASE_INTERVALS[job.phase]
+        next_run = job.next_run + interval
+        # Skip the slots missed while the bot was offline
+        while next_run <= started:
+            next_run += interval
+        job.last_run = started
+        job.next_run = next_run
+        await job.save(update_fields=["last_run", "next_run"])
+    finally:
+        _running.discard((job.guild_id, job.phase))
@@ -0,0 +1,160 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import functools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator
+
+import discord
+
+# How many phase runs are kept
+HISTORY_SIZE = 200
+
+
+class PhaseRun:
+    """
+    Counters for one run of a maintenance phase in a guild.
+
+    `rate_limits` only counts the 429s discord.py retries. The waits it
+    adds ahead of requests to stay within a bucket are only reflected in
+    `rest_time`. The time tasks spent waiting on the bot's own rate budgets
+    is summed in `budget_wait`.
+    """
+
+    def __init__(self, guild: discord.Guild, phase: str):
+        self.guild_id = guild.id
+        self.guild_name = guild.name
+        self.phase = phase
+        self.started_at = discord.utils.utcnow()
+        self.duration = 0.0
+        self.rest_calls = 0
+        self.rest_time = 0.0
+        self.rate_limits = 0
+        self.rate_limit_time = 0.0
+        self.budget_wait = 0.0
+        self.db_queries = 0
+        self.items = 0
+        self.failed = False
+
+    def __str__(self):
+        return (
+            f"{self.started_at:%m-%d %H:%M} {self.guild_name[:16]:16} "
+            f"{self.phase:9} {self.duration:7.1f}s "
+            f"{self.rest_calls:5} REST ({self.rest_time:.1f}s) "
+            f"{self.rate_limits:3} 429s ({self.rate_limit_time:.1f}s) "
+            f"budget {self.budget_wait:.1f}s "
+            f"{self.db_queries:5} DB {self.items:5} items"
+            + (" FAILED" if self.failed else "")
+        )
+
+
+# The most recent phase runs, oldest first
+history: deque[PhaseRun] = deque(maxlen=HISTORY_SIZE)
+# The phase run the current task is part of. Tasks spawned by a phase
+# inherit it, so their calls are counted too.
+_current: ContextVar[PhaseRun | None] = ContextVar("phase_run", default=None)
+
+
+@asynccontextmanager
+async def measure(guild: discord.Guild, phase: str) -> AsyncIterator[PhaseRun]:
+    """
+    Count what happens inside the block as a run of `phase`. Nested blocks
+    for the same guild and phase count towards the outer run.
+    """
+    outer = _current.get()
+    if outer and outer.guild_id == guild.id and outer.phase == phase:
+        yield outer
+        return
+    run = PhaseRun(guild, phase)
+    token = _current.set(run)
+    start = time.perf_counter()
+    try:
+        yield run
+    except BaseException:
+        run.failed = True
+        raise
+    finally:
+        run.duration = time.perf_counter() - start
+        _current.reset(token)
+        history.append(run)
+
+
+def recent_runs(
+    count: int, guild_id: int | None = None, phase: str | None = None
+) -> list[PhaseRun]:
+    """Return the last `count` runs, optionally of one guild or phase."""
+    runs = [
+        run
+        for run in history
+        if (guild_id is None or run.guild_id == guild_id)
+        and (phase is None or run.phase == phase)
+    ]
+    return runs[-count:]
+
+
+def count_budget_wait(seconds: float):
+    """Add time spent waiting on a rate budget to the current run."""
+    run = _current.get()
+    if run is not None:
+        run.budget_wait += seconds
+
+
+class _RateLimitFilter(logging.Filter):
+    """Count the rate limits discord.py logs while retrying requests."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        run = _current.get()
+        message = str(record.msg)
+        if run is not None and "Retrying in" in message and record.args:
+            run.rate_limits += 1
+            run.rate_limit_time += float(record.args[-1])
+        return True
+
+
+class _QueryFilter(logging.Filter):
+    """
+    Count the queries Tortoise logs, passing on only the records the logger
+    would have emitted anyway.
+    """
+
+    def __init__(self, level: int):
+        super().__init__()
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        run = _current.get()
+        if run is not None and record.levelno == logging.DEBUG:
+            run.db_queries += 1
+        return record.levelno >= self.level
+
+
+def install(http: discord.http.HTTPClient):
+    """Hook the REST client and the loggers that feed the counters."""
+    if getattr(http.request, "instrumented", False):
+        return
+    request = http.request
+
+    @functools.wraps(request)
+    async def counted_request(*args, **kwargs):
+        run = _current.get()
+        if run is None:
+            return await request(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await request(*args, **kwargs)
+        finally:
+            run.rest_calls += 1
+            run.rest_time += time.perf_counter() - start
+
+    counted_request.instrumented = True
+    http.request = counted_request
+
+    logging.getLogger("discord.http").addFilter(_RateLimitFilter())
+    # Tortoise only logs queries at debug level
+    db_logger = logging.getLogger("tortoise.db_client")
+    db_logger.addFilter(_QueryFilter(db_logger.getEffectiveLevel()))
+    db_logger.setLevel(logging.DEBUG)
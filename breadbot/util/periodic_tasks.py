@@ -1,24 +1,64 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
-from datetime import datetime, timedelta
-from io import BytesIO
+import asyncio
+from datetime import timedelta
 from itertools import chain
+from typing import Iterable
 
 import discord
+from tortoise.expressions import Q
+from tortoise.queryset import QuerySet
 
-from breadbot.models import Guild, ProjectChannel
+from breadbot.models import (
+    AutoThreadChannel,
+    ChannelActivity,
+    Guild,
+    ProjectCategory,
+    ProjectChannel,
+)
+from breadbot.util.activity import InactivityDetector, get_last_activity
+from breadbot.util.concurrency import gather_bounded, history_budget
 from breadbot.util.discord_objects import (
     clean_get_project_role,
     get_archive_category,
     get_archive_channel,
     get_project_categories,
 )
-from breadbot.util.export import dump_channel_contents
+from breadbot.util.export import ExportStream, dump_channel_contents
+from breadbot.util.export_cache import (
+    delete_export_cache,
+    prune_export_caches,
+)
+
+# How many channel histories are scanned at the same time
+SCAN_CONCURRENCY = 8
+# How many members have their roles removed at the same time
+ROLE_REMOVAL_CONCURRENCY = 4
 
 
-class MessageFound(Exception):
-    pass
+async def find_inactive(
+    channels: Iterable[discord.abc.GuildChannel],
+    detector: InactivityDetector,
+) -> list[discord.TextChannel]:
+    """
+    Check text channels older than 30 days for inactivity, several at a
+    time, and return the inactive ones in their original order.
+    """
+    candidates = [
+        channel
+        for channel in channels
+        if isinstance(channel, discord.TextChannel)
+        # Skip new channels
+        and channel.created_at <= discord.utils.utcnow() - timedelta(days=30)
+    ]
+    verdicts = await gather_bounded(
+        (detector.is_inactive(channel) for channel in candidates),
+        SCAN_CONCURRENCY,
+    )
+    return [
+        channel for channel, inactive in zip(candidates, verdicts) if inactive
+    ]
 
 
 async def archive_inactive_inner(
@@ -30,32 +70,23 @@ async def archive_inactive_inner(
     """Archive project channels that have been inactive for over 90 days."""
     archive_category = get_archive_category(discord_guild, guild)
     if archive_category is None:
-        return
+        return 0
 
     if verbose:
         await log_channel.send("Archiving inactive project channels.")
     archived = 0
-    for channel in chain.from_iterable(
-        c.channels for c in get_project_categories(discord_guild, guild)
+    detector = InactivityDetector(
+        guild,
+        discord.utils.utcnow() - timedelta(days=90),
+        await get_last_activity(guild),
+        budget=history_budget,
+    )
+    for channel in await find_inactive(
+        chain.from_iterable(
+            c.channels for c in get_project_categories(discord_guild, guild)
+        ),
+        detector,
     ):
-        if not isinstance(channel, discord.TextChannel):
-            continue
-
-        # Skip new channels
-        if channel.created_at > discord.utils.utcnow() - timedelta(days=30):
-            continue
-
-        try:
-            async for message in channel.history(
-                limit=None,
-                after=datetime.now() - timedelta(days=90),
-                oldest_first=True,
-            ):
-                if not message.author.bot:
-                    raise MessageFound("Found a non-bot message!")
-        except MessageFound:
-            continue
-
         await log_channel.send(
             f"Archiving {channel.mention} due to inactivity."
         )
@@ -83,8 +114,12 @@ async def archive_inactive_inner(
             )
         archived += 1
 
+    print(detector.summary())
+    if verbose:
+        await log_channel.send(detector.summary())
     if verbose or archived > 0:
         await log_channel.send(f"Archived {archived} inactive channels.")
+    return archived
 
 
 async def delete_channel_inner(
@@ -93,7 +128,6 @@ async def delete_channel_inner(
     guild: Guild,
 ):
     """Handle deleting a channel."""
-    pings = []
     archive_channel = get_archive_channel(discord_guild, guild)
     if archive_channel is None:
         await channel.send(
@@ -103,32 +137,61 @@ async def delete_channel_inner(
 
     lang_owner_role = discord_guild.get_role(guild.channel_owner_role_id)
     project_channel = await ProjectChannel.get_or_none(id=channel.id)
+    owner_role = None
     if project_channel:
-        owner_role = discord.utils.get(
-            discord_guild.roles, id=project_channel.owner_role
-        )
+        owner_role = discord_guild.get_role(project_channel.owner_role)
+    pings = owner_role.members if owner_role else []
+
+    async def remove_roles():
         if owner_role:
             roles_to_remove = [owner_role]
             if lang_owner_role is not None:
                 roles_to_remove.append(lang_owner_role)
-            for user in discord_guild.members:
-                if owner_role in user.roles:
-                    await user.remove_roles(
-                        *roles_to_remove,
-                        reason="Deleting dead channel",
+            await gather_bounded(
+                (
+                    user.remove_roles(
+                        *roles_to_remove, reason="Deleting dead channel"
                     )
-                    pings.append(user)
-        await project_channel.delete()
-    io = BytesIO()
-    await dump_channel_contents(channel, io)
-    io.seek(0)
-    await archive_channel.send(
-        f"Log for {channel.name} "
-        f""
-        f"({', '.join(user.mention for user in pings)}):",
-        file=discord.File(io, filename=f"history_{channel.name}.txt"),
-    )
+                    for user in pings
+                ),
+                ROLE_REMOVAL_CONCURRENCY,
+            )
+        if project_channel:
+            await project_channel.delete()
+
+    async def upload(file: discord.File, part: int, last: bool):
+        if part == 1:
+            await archive_channel.send(
+                f"Log for {channel.name} "
+                f""
+                f"({', '.join(user.mention for user in pings)}):",
+                file=file,
+            )
+        else:
+            await archive_channel.send(file=file)
+
+    async def upload_structured(file: discord.File, part: int, last: bool):
+        await archive_channel.send(file=file)
+
+    async def export():
+        await dump_channel_contents(
+            channel,
+            ExportStream(
+                upload,
+                f"history_{channel.name}.txt",
+                discord_guild.filesize_limit,
+            ),
+            ExportStream(
+                upload_structured,
+                f"history_{channel.name}.ndjson",
+                discord_guild.filesize_limit,
+                "gzip",
+            ),
+        )
+
+    await asyncio.gather(remove_roles(), export())
     await channel.delete(reason="Deleting dead channel.")
+    delete_export_cache(discord_guild.id, channel.id)
 
 
 async def delete_dead_channels(
@@ -140,29 +203,20 @@ async def delete_dead_channels(
     """Archive project channels that have been inactive for over 90 days."""
     archive_category = get_archive_category(discord_guild, guild)
     if archive_category is None:
-        return
+        return 0
     archive_channel = get_archive_channel(discord_guild, guild)
     if archive_channel is None:
-        return
+        return 0
     if verbose:
         await log_channel.send("Deleting dead project channels.")
     archived = 0
-    for channel in archive_category.channels:
-        if not isinstance(channel, discord.TextChannel):
-            continue
-        if channel.created_at > discord.utils.utcnow() - timedelta(days=30):
-            continue
-        try:
-            async for message in channel.history(
-                limit=None,
-                after=discord.utils.utcnow() - timedelta(days=30 * 6),
-                oldest_first=True,
-            ):
-                if not message.author.bot:
-                    raise MessageFound("Found a non-bot message!")
-        except MessageFound:
-            continue
-
+    detector = InactivityDetector(
+        guild,
+        discord.utils.utcnow() - timedelta(days=30 * 6),
+        await get_last_activity(guild),
+        budget=history_budget,
+    )
+    for channel in await find_inactive(archive_category.channels, detector):
         await archive_channel.send(
             f"{channel.name} has had no activity in over three months. "
             f"Deleting..."
@@ -170,8 +224,20 @@ async def delete_dead_channels(
         await delete_channel_inner(channel, discord_guild, guild)
         archived += 1
 
+    print(detector.summary())
+    if verbose:
+        await log_channel.send(detector.summary())
     if verbose or archived > 0:
         await log_channel.send(f"Deleted {archived} dead channels.")
+    return archived
+
+
+async def _delete_stale(query: QuerySet) -> int:
+    """Delete the rows matched by `query`, returning how many there were."""
+    stale = await query.values_list("id", flat=True)
+    if stale:
+        await query.model.filter(id__in=stale).delete()
+    return len(stale)
 
 
 async def cleanup_db(
@@ -179,13 +245,38 @@ async def cleanup_db(
     guild: Guild,
     log_channel: discord.TextChannel,
 ):
-    """Remove entries from the database that no longer exist."""
-    async for channel in ProjectChannel.filter(guild=guild):
-        if (
-            discord_guild.get_channel(channel.id) is None
-            or discord_guild.get_role(channel.owner_role) is None
-        ):
-            await channel.delete()
-            await log_channel.send(
-                f"Removed channel {channel.id} from the database."
+    """
+    Remove database entries and export caches of channels and roles that
+    no longer exist.
+    """
+    channel_ids = [channel.id for channel in discord_guild.channels]
+    role_ids = [role.id for role in discord_guild.roles]
+    removed = {
+        "project channels": await _delete_stale(
+            ProjectChannel.filter(
+                ~Q(id__in=channel_ids) | ~Q(owner_role__in=role_ids),
+                guild=guild,
+            )
+        ),
+        "project categories": await _delete_stale(
+            ProjectCategory.filter(guild=guild).exclude(id__in=channel_ids)
+        ),
+        "auto thread channels": await _delete_stale(
+            AutoThreadChannel.filter(guild=guild).exclude(id__in=channel_ids)
+        ),
+        "channel activity records": await _delete_stale(
+            ChannelActivity.filter(guild=guild).exclude(id__in=channel_ids)
+        ),
+        "channel export caches": await asyncio.to_thread(
+            prune_export_caches, discord_guild.id, channel_ids
+        ),
+    }
+    if any(removed.values()):
+        await log_channel.send(
+            "Removed stale entries: "
+            + ", ".join(
+                f"{count} {kind}" for kind, count in removed.items() if count
             )
+            + "."
+        )
+    return sum(removed.values())
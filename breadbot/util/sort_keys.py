@@ -0,0 +1,57 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import re
+import unicodedata
+from string import ascii_uppercase, digits
+from typing import Iterable, NamedTuple
+
+import discord
+
+# Leading characters that aren't ASCII letters or digits all go here
+OTHER_BUCKET = "#"
+
+
+class ChannelKey(NamedTuple):
+    """Precomputed sort key for a channel."""
+
+    # Letter group the channel belongs to, used for category boundaries
+    letter: str
+    # Casefolded name with digit runs as integers, so "lang2" < "lang10"
+    natural: tuple[str | int, ...]
+    name: str
+    id: int
+
+
+def letter_bucket(name: str) -> str:
+    """Return the letter group for a channel name."""
+    # NFKD splits accented letters so "é" lands with "E"
+    first = unicodedata.normalize("NFKD", name[:1])[:1].upper()
+    if first and first in ascii_uppercase + digits:
+        return first
+    return OTHER_BUCKET
+
+
+def natural_key(name: str) -> tuple[str | int, ...]:
+    """Casefold a name and turn its digit runs into integers."""
+    parts: list[str | int] = re.split(r"(\d+)", name.casefold())
+    for i in range(1, len(parts), 2):
+        parts[i] = int(parts[i])
+    return tuple(parts)
+
+
+def channel_key(channel: discord.abc.GuildChannel) -> ChannelKey:
+    """Compute the sort key for a channel."""
+    return ChannelKey(
+        letter_bucket(channel.name),
+        natural_key(channel.name),
+        channel.name,
+        channel.id,
+    )
+
+
+def channel_keys(
+    channels: Iterable[discord.abc.GuildChannel],
+) -> dict[int, ChannelKey]:
+    """Compute sort keys for many channels at once, keyed by channel ID."""
+    return {channel.id: channel_key(channel) for channel in channels}
@@ -0,0 +1,97 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import asyncio
+import traceback
+from collections import defaultdict
+
+import discord
+
+from breadbot.models import Guild
+from breadbot.util.channel_sorting import (
+    SortPlan,
+    reposition_channel,
+    sort_inner,
+)
+from breadbot.util.discord_objects import get_log_channel
+from breadbot.util.metrics import measure
+
+
+class SortScheduler:
+    """
+    Coalesce sort requests per guild.
+
+    Triggers mark a guild dirty with `request()`, and a single worker per
+    guild sorts it once no new requests have come in for `delay` seconds.
+    Only one sort or single-channel move runs per guild at a time; requests
+    that come in while a sort runs are merged into one follow-up sort.
+    """
+
+    def __init__(self, delay: float = 30.0):
+        self.delay = delay
+        # Guild ID -> event loop time of the latest pending request
+        self._requested: dict[int, float] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+        self._locks: dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    def request(self, discord_guild: discord.Guild):
+        """Mark a guild as needing a sort."""
+        self._requested[discord_guild.id] = asyncio.get_running_loop().time()
+        worker = self._workers.get(discord_guild.id)
+        if worker is None or worker.done():
+            self._workers[discord_guild.id] = asyncio.create_task(
+                self._worker(discord_guild)
+            )
+
+    async def _worker(self, discord_guild: discord.Guild):
+        loop = asyncio.get_running_loop()
+        while discord_guild.id in self._requested:
+            wait = self._requested[discord_guild.id] + self.delay - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                await self.run_now(discord_guild)
+            except Exception:
+                traceback.print_exc()
+
+    async def run_now(
+        self, discord_guild: discord.Guild, verbose: bool = False
+    ) -> SortPlan | None:
+        """
+        Sort a guild right away, absorbing any pending request. If a sort is
+        already running, wait for it first.
+        """
+        async with self._locks[discord_guild.id]:
+            self._requested.pop(discord_guild.id, None)
+            guild = await Guild.get_or_none(
+                id=discord_guild.id
+            ).prefetch_related("project_channels", "project_categories")
+            if guild is None or not guild.project_categories:
+                return None
+            log_channel = get_log_channel(discord_guild, guild)
+            if log_channel is None:
+                return None
+            async with measure(discord_guild, "sort") as run:
+                plan = await sort_inner(
+                    discord_guild,
+                    guild,
+                    log_channel,
+                    verbose=verbose,
+                    bulk=True,
+                )
+                run.items = plan.moves_made
+            return plan
+
+    async def reposition(
+        self, channel: discord.TextChannel, project_categories
+    ):
+        """
+        Move one channel into place, waiting for any sort of its guild to
+        finish first.
+        """
+        async with self._locks[channel.guild.id]:
+            await reposition_channel(channel, project_categories)
+
+
+sort_scheduler = SortScheduler()
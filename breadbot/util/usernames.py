@@ -1,11 +1,15 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import sys
+import traceback
 import unicodedata
+import zlib
+from collections import defaultdict
 
 import discord
 
-from breadbot.models import Guild
+from breadbot.models import CheckedName, Guild
 from breadbot.util.discord_objects import get_log_channel
 
 
@@ -25,15 +29,114 @@ def normalized_username(member: discord.Member) -> str:
     )
 
 
-async def maybe_normalize_nickname(member: discord.Member):
-    """Maybe normalize a member's nickname."""
+def name_fingerprint(name: str) -> int:
+    """Return a compact fingerprint of a display name."""
+    return zlib.crc32(name.encode())
+
+
+# Members whose names changed since their guild's last sweep, by guild ID
+_dirty: dict[int, set[int]] = defaultdict(set)
+# Guilds that were swept in full since startup
+_swept: set[int] = set()
+
+
+def mark_dirty(member: discord.Member):
+    """Have the next sweep check a member's name."""
+    _dirty[member.guild.id].add(member.id)
+
+
+async def normalize_nickname(
+    member: discord.Member, log_channel: discord.TextChannel | None
+) -> str:
+    """Normalize a member's nickname if needed, returning the new name."""
     normalized = normalized_username(member)
     if normalized != member.display_name:
-        log_channel = get_log_channel(
-            member.guild, await Guild.get(id=member.guild.id)
-        )
         if log_channel:
             await log_channel.send(
                 f"Renaming {member.mention}: {member.display_name} -> {normalized}"
             )
-        await member.edit(nick=normalized_username(member))
+        await member.edit(nick=normalized)
+    return normalized
+
+
+async def maybe_normalize_nickname(member: discord.Member):
+    """Maybe normalize a member's nickname."""
+    if normalized_username(member) != member.display_name:
+        log_channel = get_log_channel(
+            member.guild, await Guild.get(id=member.guild.id)
+        )
+        await normalize_nickname(member, log_channel)
+
+
+async def normalize_nicknames(
+    discord_guild: discord.Guild,
+    guild: Guild,
+    log_channel: discord.TextChannel | None,
+):
+    """
+    Normalize the nicknames of the members of a guild whose names changed
+    since they were last checked.
+
+    The first sweep after startup compares every member's name against the
+    stored fingerprints, to catch changes made while the bot was offline.
+    Later sweeps only check the members marked dirty since.
+    """
+    dirty = _dirty.pop(discord_guild.id, set())
+    if discord_guild.id in _swept:
+        members = filter(None, map(discord_guild.get_member, dirty))
+    else:
+        checked = dict(
+            await CheckedName.filter(guild=guild).values_list(
+                "member_id", "fingerprint"
+            )
+        )
+        members = (
+            member
+            for member in discord_guild.members
+            if member.id in dirty
+            or checked.get(member.id) != name_fingerprint(member.display_name)
+        )
+    members = list(members)
+    fingerprints = []
+    done = 0
+    try:
+        for member in members:
+            try:
+                name = await normalize_nickname(member, log_channel)
+            except discord.Forbidden:
+                # Members above the bot can't be renamed; don't retry them
+                # until their name changes
+                print(
+                    f"[{discord_guild.name}] Not allowed to rename {member}",
+                    file=sys.stderr,
+                )
+                name = member.display_name
+            except discord.HTTPException:
+                print(
+                    f"[{discord_guild.name}] Failed to rename {member}",
+                    file=sys.stderr,
+                )
+                traceback.print_exc()
+                mark_dirty(member)
+                done += 1
+                continue
+            fingerprints.append(
+                CheckedName(
+                    guild=guild,
+                    member_id=member.id,
+                    fingerprint=name_fingerprint(name),
+                )
+            )
+            done += 1
+    finally:
+        # Check whatever an unexpected error left out next time
+        for member in members[done:]:
+            mark_dirty(member)
+        if fingerprints:
+            await CheckedName.bulk_create(
+                fingerprints,
+                update_fields=["fingerprint"],
+                on_conflict=["guild_id", "member_id"],
+            )
+    _swept.add(discord_guild.id)
+    return len(fingerprints)